@@ -3,80 +3,419 @@
 #   - steps_per_degree = 4096/360
 #   - delay in microseconds
 
-import time
+import math
 import multiprocessing
+import numbers
 from shifter import Shifter
+from step_scheduler import StepScheduler
+from step_timer import ReportRing
+
+# asyncio, NumPy (motion profiles, telemetry) and the trace recorder
+# are imported where they are first needed (NumPy by the first move, see
+# step_scheduler): together they are most of this module's import time.
+
+# Drive modes.  Positions are always counted in half-steps (4096/rev)
+# and the coils always follow Stepper.seq; a mode is just which entries
+# of seq it visits:
+#   half: every entry (alternating 1 and 2 coils)  1 half-step per shift
+#   full: odd entries (2 coils on, more torque)    2 half-steps per shift
+#   wave: even entries (1 coil on, least current)  2 half-steps per shift
+# so full/wave slews need half the shifts per revolution.
+DRIVE_MODES = {'half': (1, None), 'full': (2, 1), 'wave': (2, 0)}  # (stride, phase parity)
+
+
+def _drive_table(stride: int, parity: int | None, dir_sign: int) -> tuple:
+    """(next phase, half-steps moved) for each current phase.  A phase of
+    the wrong parity for the mode is realigned with a single half-step,
+    so switching modes never loses track of position."""
+    table = []
+    for phase in range(8):
+        if parity is not None and phase % 2 != parity:
+            table.append(((phase + dir_sign) % 8, 1))
+        else:
+            table.append(((phase + stride * dir_sign) % 8, stride))
+    return tuple(table)
+
+
+class MoveHandle:
+    """
+    Completion handle for one queued move (a minimal future).
+
+    join() is kept so code written for the old per-move Process
+    objects (p = m.goAngle(90); p.join()) works unchanged.
+    """
+
+    def __init__(self, stepper: "Stepper", move_id: int):
+        self._stepper = stepper
+        self.move_id = move_id
+        self._cancelled = False
+
+    def done(self) -> bool:
+        """True once the move has finished, been cancelled or flushed."""
+        return self._stepper._completed.value >= self.move_id
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until done (or timeout); returns done()."""
+        return self._stepper._wait_for(self.move_id, timeout)
+
+    def join(self, timeout: float | None = None) -> None:
+        self.wait(timeout)
+
+    def cancel(self) -> bool:
+        """Abort the move if it is queued or running.  Returns False if
+        it had already finished."""
+        if self.done():
+            return False
+        self._stepper._control('cancel', self.move_id)
+        self._cancelled = True
+        return True
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def report(self, timeout: float | None = None):
+        """Wait for the move and return its step_timer.MoveReport
+        (achieved rate, late steps), or None if it is not done yet."""
+        if not self.wait(timeout):
+            return None
+        return self._stepper.report(self.move_id)
+
+    def __await__(self):
+        """`await handle` waits for the move without blocking the event
+        loop; cancelling the awaiting task cancels the move."""
+        return self._wait_async().__await__()
+
+    async def _wait_async(self, poll: float = 0.002) -> None:
+        # Poll the shared completion counter rather than parking a
+        # thread per waiter, so any number of tasks can wait cheaply.
+        import asyncio  # already loaded by whoever is awaiting
+        try:
+            while not self.done():
+                await asyncio.sleep(poll)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+    def __repr__(self):
+        state = "cancelled" if self._cancelled else ("done" if self.done() else "pending")
+        return f"<MoveHandle #{self.move_id} {state}>"
+
+
+def start_together(*moves) -> list[MoveHandle]:
+    """
+    Submit several moves so they start on the same tick.
+
+    moves are (stepper, kind, value, mode, scale) tuples, kind being
+    'rotate' (degrees), 'goto' (degrees) or 'steps' (absolute half-step
+    target); scale stretches every step delay.  Moves for motors on the
+    same shifter reach its scheduler in one message, so idle motors
+    start together.
+    """
+    handles = []
+    batches = {}
+    for stepper, kind, value, mode, scale in moves:
+        cmd, handle = stepper._command(kind, value, mode, scale)
+        batches.setdefault(stepper._scheduler, []).append(cmd)
+        handles.append(handle)
+    for scheduler, cmds in batches.items():
+        scheduler.submit(*cmds)
+    return handles
+
 
 class Stepper:
-    num_steppers = 0
-    shifter_outputs = multiprocessing.Value('i', 0)
     seq = [0b0001,0b0011,0b0010,0b0110,0b0100,0b1100,0b1000,0b1001]
     delay = 1200
-    steps_per_degree = 4096/360.0
+    drive_mode = 'half'
+    # drive_tables[mode][dir_sign > 0][phase] -> (next phase, half-steps moved)
+    drive_tables = {mode: (_drive_table(stride, parity, -1), _drive_table(stride, parity, 1))
+                    for mode, (stride, parity) in DRIVE_MODES.items()}
+    steps_per_rev = 4096  # half-steps
+    steps_per_degree = steps_per_rev/360.0
+    profile = None  # MotionProfile, or None to step at the constant delay
 
-    def __init__(self, shifter: Shifter, lock: multiprocessing.Lock):
+    def __init__(self, shifter: Shifter, lock=None):
+        # lock is no longer needed (the scheduler is the only process
+        # that touches the shifter) but is still accepted.
         self.s = shifter
-        self.angle = multiprocessing.Value('d', 0.0)
-        self.step_state = 0
-        self.shifter_bit_start = 4 * Stepper.num_steppers
+        # Position in half-steps since zero(), unwrapped (multi-turn).
+        # Only the scheduler worker writes it, one aligned native long,
+        # so it can be read from any process without a lock.
+        self._position = multiprocessing.RawValue('l', 0)
+        self._phase = multiprocessing.RawValue('i', 0)  # index into seq
+        self._dirty = None  # see use_state()
+        # Each motor takes the next 4 free outputs of its own shifter,
+        # so motors on different shifters never share bit offsets.
+        self.shifter_bit_start = shifter.allocate(4)
         self.lock = lock
-        Stepper.num_steppers += 1
-
-    def __sgn(self, x: float) -> int:
-        if x == 0: return 0
-        return 1 if x > 0 else -1
-
-    def __step(self, dir_sign: int) -> None:
-        self.step_state = (self.step_state + dir_sign) % 8
-        with self.lock:
-            sep = Stepper.shifter_outputs.value
-            sep &= ~(0b1111 << self.shifter_bit_start)
-            sep |= (Stepper.seq[self.step_state] << self.shifter_bit_start)
-            Stepper.shifter_outputs.value = sep
-            self.s.shiftByte(sep)
-        with self.angle.get_lock():
-            self.angle.value = (self.angle.value + dir_sign / Stepper.steps_per_degree) % 360.0
-
-    def __rotate(self, delta_deg: float) -> None:
-        num_steps = int(abs(delta_deg) * Stepper.steps_per_degree)
-        dir_sign = self.__sgn(delta_deg)
-        for _ in range(num_steps):
-            self.__step(dir_sign)
-            time.sleep(Stepper.delay / 1e6)
-
-    def rotate(self, delta_deg: float) -> multiprocessing.Process:
-        p = multiprocessing.Process(target=self.__rotate, args=(delta_deg,))
-        p.start()
-        return p
 
-    def rotate_sync(self, delta_deg: float) -> None:
-        p = self.rotate(delta_deg)
-        p.join()
+        # Moves are stepped by the Shifter's StepScheduler, which drives
+        # every motor on that shifter from one worker process.  Move ids
+        # increase by one per submitted move and run in order, so the
+        # last finished id is all we need to know which moves are done.
+        self._scheduler = StepScheduler.for_shifter(shifter)
+        self._slot = self._scheduler.attach(self)
+        self._cond = self._scheduler.cond
+        self._completed = multiprocessing.RawValue('q', 0)  # last finished move id
+        self._submitted = 0
+        self._reports = ReportRing(64)  # MoveReports of the last 64 moves
+
+    @property
+    def step_state(self) -> int:
+        return self._phase.value
+
+    # Angles are derived from the step count when read, so the step
+    # path does no float math and never drifts.
+
+    @property
+    def position(self) -> int:
+        """Half-steps since zero(), counting whole turns."""
+        return self._position.value
+
+    @property
+    def turns(self) -> int:
+        """Whole revolutions since zero() (negative below zero)."""
+        return self._position.value // self.steps_per_rev
+
+    @property
+    def angle(self) -> float:
+        """Shaft angle in degrees, 0 <= angle < 360."""
+        return (self._position.value % self.steps_per_rev) / self.steps_per_degree
+
+    @property
+    def total_angle(self) -> float:
+        """Shaft angle in degrees without wrapping (multi-turn)."""
+        return self._position.value / self.steps_per_degree
+
+    def use_state(self, position, phase, dirty=None) -> None:
+        """
+        Keep the step count and coil phase in the given shared ctypes
+        values (anything with a .value, e.g. turret_state views into a
+        memory-mapped file) instead of this motor's own RawValues.  The
+        motor takes on the values stored there.
+
+        dirty, if given, is set to 1 by the worker when it starts a move
+        and back to 0 once every motor on the shifter is at rest, so it
+        is only 1 while the stored position may be mid-move.
+        """
+        if self._scheduler.running():
+            # the worker holds the old values: restart it on the next move
+            self._scheduler.close()
+        self._position = position
+        self._phase = phase
+        self._dirty = dirty
 
-    def goAngle(self, angle: float) -> multiprocessing.Process:
+    def half_steps_to(self, angle: float) -> int:
+        """Signed half-steps goAngle(angle) would take from here."""
+        return int(self._shortest_delta(angle) * self.steps_per_degree)
+
+    def move_time(self, half_steps: int, mode: str | None = None) -> float:
+        """Estimated duration (s) of a move of half_steps with this
+        motor's profile (or constant delay) and drive mode."""
+        stride = DRIVE_MODES[mode or self.drive_mode][0]
+        shifts = -(-abs(half_steps) // stride)
+        if self.profile is not None:
+            return self.profile.move_time(shifts)
+        return shifts * self.delay / 1e6
+
+    def cruise_time(self, half_steps: int, mode: str | None = None,
+                    entry_rate: float | None = None) -> float:
+        """Shortest time (s) half_steps can take at a constant rate: at
+        the profile's max_velocity, or the step delay without one.
+
+        entry_rate is the rate (steps/s, see step_rate()) the motor is
+        already stepping at when this starts, 0 from standstill.  With a
+        profile the new rate may then be no higher than the profile's
+        start_velocity, or entry_rate plus what its acceleration adds
+        over the move, whichever allows more."""
+        stride = DRIVE_MODES[mode or self.drive_mode][0]
+        shifts = -(-abs(half_steps) // stride)
+        p = self.profile
+        if p is None:
+            return shifts * self.delay / 1e6
+        fastest = shifts / p.max_velocity
+        if entry_rate is None or shifts == 0:
+            return fastest
+        # shifts / t <= entry_rate + acceleration * t, solved for t
+        ramp = (math.sqrt(entry_rate ** 2 + 4 * p.acceleration * shifts) - entry_rate) \
+            / (2 * p.acceleration)
+        return max(fastest, min(shifts / p.start_velocity, ramp))
+
+    def step_rate(self, half_steps: int, seconds: float, mode: str | None = None) -> float:
+        """Rate (steps/s, the profile's units) of half_steps spread evenly
+        over seconds."""
+        stride = DRIVE_MODES[mode or self.drive_mode][0]
+        return -(-abs(half_steps) // stride) / seconds
+
+    def _shortest_delta(self, angle: float) -> float:
         angle = angle % 360.0
-        current = self.angle.value
+        current = self.angle
         delta = angle - current
         if delta > 180.0:
             delta -= 360.0
         elif delta < -180.0:
             delta += 360.0
-        return self.rotate(delta)
+        return delta
+
+    def _command(self, kind: str, value: float, mode: str | None = None,
+                 scale: float = 1.0) -> tuple[tuple, MoveHandle]:
+        """Build a scheduler command for this motor and its handle."""
+        mode = mode or self.drive_mode
+        if mode not in DRIVE_MODES:
+            raise ValueError(f"unknown drive mode {mode!r} (use one of {', '.join(DRIVE_MODES)})")
+        # Check here, in the caller: a bad value reaching the worker would
+        # only fail there, out of sight of whoever asked for it.
+        if kind == 'segment':
+            values = value      # (half-step target, seconds)
+        elif kind == 'timeline':
+            values = ()         # arrays from motion_program.compile_program
+        else:
+            values = (value,)
+        for x in (*values, scale):
+            if not isinstance(x, numbers.Real) or not math.isfinite(x):
+                raise ValueError(f"{kind}: expected a finite number, got {x!r}")
+        if scale <= 0 or (kind == 'segment' and value[1] <= 0):
+            raise ValueError(f"{kind}: scale and duration must be positive")
+        self._submitted += 1
+        # The delay travels with the move (like the profile): the worker
+        # only has the copy of this Stepper it was forked with.
+        cmd = (self._slot, self._submitted, kind, value, self.profile, mode, scale, self.delay)
+        return cmd, MoveHandle(self, self._submitted)
+
+    def __submit(self, kind: str, value: float, mode: str | None) -> MoveHandle:
+        cmd, handle = self._command(kind, value, mode)
+        self._scheduler.submit(cmd)
+        return handle
+
+    def _control(self, kind: str, move_id: int) -> None:
+        """Tell the worker to drop move_id ('cancel') or every move up
+        to and including it ('flush').  Sent through the queue like the
+        moves themselves, so several cancels never overwrite each other."""
+        self._scheduler.submit((self._slot, 0, kind, move_id, None, None, 1.0, None))
+
+    def _wait_for(self, move_id: int, timeout: float | None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._completed.value >= move_id, timeout)
+
+    def report(self, move_id: int | None = None):
+        """Timing report (step_timer.MoveReport) of a finished move,
+        by default the last one.  None if it is unknown or too old."""
+        if move_id is None:
+            move_id = self._completed.value
+        # The worker stores the report before marking the move done.
+        if move_id > self._completed.value:
+            return None
+        return self._reports.get(move_id)
+
+    # ---------- telemetry ----------
+
+    def enable_telemetry(self, capacity: int = 65536):
+        """Start recording per-step timing (step_telemetry.StepTelemetry).
+        The recorder is shared by every motor on this shifter; records
+        carry each motor's slot."""
+        return self._scheduler.enable_telemetry(capacity)
+
+    def disable_telemetry(self) -> None:
+        self._scheduler.disable_telemetry()
+
+    def telemetry_summary(self, move_id: int | None = None):
+        """Lateness and shift-time percentiles for this motor (or one of
+        its moves), or None if telemetry is off or nothing was recorded."""
+        telemetry = self._scheduler.telemetry
+        if telemetry is None:
+            return None
+        return telemetry.summary(self._slot, move_id)
+
+    # ---------- recording ----------
+
+    def start_recording(self, path: str):
+        """Append every move command and latched shift word on this
+        motor's shifter to a motion_trace file (see motion_trace.replay).
+        Returns the TraceRecorder."""
+        from motion_trace import TraceRecorder
+        recorder = TraceRecorder(path)
+        self._scheduler.start_recording(recorder)
+        return recorder
+
+    def stop_recording(self) -> None:
+        """Let queued moves finish, then close the trace."""
+        self._scheduler.stop_recording()
+
+    # ---------- motion API ----------
+
+    def rotate(self, delta_deg: float, mode: str | None = None) -> MoveHandle:
+        """Turn by delta_deg.  mode ('half', 'full', 'wave') overrides
+        drive_mode for this move only."""
+        return self.__submit('rotate', delta_deg, mode)
+
+    def rotate_sync(self, delta_deg: float) -> None:
+        p = self.rotate(delta_deg)
+        p.join()
+
+    def goAngle(self, angle: float, mode: str | None = None) -> MoveHandle:
+        return self.__submit('goto', angle, mode)
+
+    def retarget(self, angle: float, mode: str | None = None) -> MoveHandle:
+        """
+        Like goAngle, but preempts: the running move (and anything queued
+        behind it) is replaced by a move to `angle`, starting on the next
+        step.  With a profile the motor keeps its current speed, or brakes
+        and comes back if the new target is behind it.  Use this to
+        follow a moving target with a stream of setpoints.
+        """
+        return self.__submit('retarget', angle, mode)
 
     def zero(self) -> None:
-        self.angle.value = 0.0
+        """Make the current position 0.  Runs in order with queued moves
+        so the scheduler stays the only writer of the step count."""
+        if self._scheduler.running():
+            self.__submit('zero', 0, None).wait()
+        else:
+            self._position.value = 0
+
+    # ---------- queue control ----------
+
+    def queue_depth(self) -> int:
+        """Moves submitted but not yet finished (including the running one)."""
+        return self._submitted - self._completed.value
+
+    def busy(self) -> bool:
+        return self.queue_depth() > 0
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Block until every submitted move has finished."""
+        return self._wait_for(self._submitted, timeout)
+
+    def cancel(self) -> bool:
+        """Abort the move that is currently running; queued moves still run."""
+        if not self.busy():
+            return False
+        self._control('cancel', self._completed.value + 1)
+        return True
+
+    def flush(self) -> int:
+        """Abort the running move and drop everything queued behind it.
+        Returns the number of moves discarded."""
+        dropped = self.queue_depth()
+        if dropped:
+            self._control('flush', self._submitted)
+        return dropped
+
+    def close(self, timeout: float | None = 1.0) -> None:
+        """Drop this motor's pending moves and stop the scheduler worker
+        (it restarts on the next move of any motor on this shifter)."""
+        self.flush()
+        self._scheduler.close(timeout)
 
 
 if __name__ == '__main__':
     s = Shifter(data=16, latch=20, clock=21)
-    lock = multiprocessing.Lock()
 
-    m1 = Stepper(s, lock)
-    m2 = Stepper(s, lock)
+    m1 = Stepper(s)
+    m2 = Stepper(s)
 
     m1.zero()
     m2.zero()
-    print(f"Zeroed: m1={m1.angle.value:.1f}°, m2={m2.angle.value:.1f}°")
+    print(f"Zeroed: m1={m1.angle:.1f}°, m2={m2.angle:.1f}°")
 
     # Step 4: run sequences, both at same time
     p1 = m1.goAngle(90)
@@ -98,4 +437,4 @@ if __name__ == '__main__':
     p1 = m1.goAngle(0)
     p1.join()
 
-    print(f"Final angles: m1={m1.angle.value:.1f}°, m2={m2.angle.value:.1f}°")
+    print(f"Final angles: m1={m1.angle:.1f}°, m2={m2.angle:.1f}°")
@@ -0,0 +1,103 @@
+# aiming.py
+#
+# Target positions -> turret pan/tilt angles.
+#
+# The turret sits at a known spot (x, y) with its pivot at some height,
+# and points along `heading` (world degrees, counter-clockwise from +x)
+# when pan is 0.  For every target the pan angle is the bearing to it
+# relative to that heading, wrapped to [-180, 180), and the tilt angle
+# is its elevation above the pivot.  All targets are solved in one
+# NumPy pass, and the result for a target set is cached (LRU), so
+# re-aiming at the same field of targets costs a dictionary lookup.
+#
+# Positions can be Cartesian (x, y, z) or cylindrical (r, theta, z),
+# theta in radians, both relative to the same origin, e.g. the centre
+# of the arena.
+#
+# Example:
+#
+#     aimer = Aimer.from_cylindrical(r=300, theta=math.pi / 2, height=5)
+#     angles = aimer.solve([(300, 0.0, 20), (300, math.pi, 40)], cylindrical=True)
+#     for pan, tilt in angles:
+#         turret.goto(pan, tilt)
+#     # or: plan = plan_sequence(turret, angles); aimer.goto(turret, target)
+
+import math
+from functools import lru_cache
+import numpy as np
+
+
+def to_cartesian(points: np.ndarray) -> np.ndarray:
+    """(n, 3) cylindrical (r, theta [rad], z) -> (n, 3) Cartesian (x, y, z)."""
+    r, theta, z = points[:, 0], points[:, 1], points[:, 2]
+    return np.column_stack((r * np.cos(theta), r * np.sin(theta), z))
+
+
+@lru_cache(maxsize=64)
+def _solve(origin: tuple, heading: float, data: bytes, cylindrical: bool) -> np.ndarray:
+    points = np.frombuffer(data, dtype=float).reshape(-1, 3)
+    if cylindrical:
+        points = to_cartesian(points)
+    d = points - np.asarray(origin)
+    pan = np.degrees(np.arctan2(d[:, 1], d[:, 0])) - heading
+    pan = (pan + 180.0) % 360.0 - 180.0
+    tilt = np.degrees(np.arctan2(d[:, 2], np.hypot(d[:, 0], d[:, 1])))
+    angles = np.column_stack((pan, tilt))
+    angles.setflags(write=False)
+    return angles
+
+
+class Aimer:
+
+    def __init__(self, position=(0.0, 0.0), height: float = 0.0, heading: float = 0.0):
+        """
+        position:
+            (x, y) of the turret's pan axis.
+        height:
+            z of the tilt pivot, in the same units as the targets.
+        heading:
+            world direction (degrees, counter-clockwise from +x) the
+            turret faces at pan = 0.
+        """
+        self.position = (float(position[0]), float(position[1]))
+        self.height = float(height)
+        self.heading = float(heading)
+
+    @classmethod
+    def from_cylindrical(cls, r: float, theta: float, height: float = 0.0,
+                         heading: float | None = None) -> "Aimer":
+        """
+        A turret at cylindrical (r, theta [rad]).  heading defaults to
+        facing the origin, as for a turret on the rim of a circular
+        arena with pan 0 pointing at the centre.
+        """
+        x, y = r * math.cos(theta), r * math.sin(theta)
+        if heading is None:
+            heading = math.degrees(math.atan2(-y, -x)) if r else 0.0
+        return cls((x, y), height, heading)
+
+    def solve(self, targets, cylindrical: bool = False) -> np.ndarray:
+        """
+        Pan/tilt *turret* angles (degrees) for targets, an (n, 3) array
+        of (x, y, z), or (r, theta, z) if cylindrical.  Returns an (n, 2)
+        read-only array of (pan, tilt) rows, one per target; cached by
+        the targets' values.
+        """
+        points = np.ascontiguousarray(targets, dtype=float).reshape(-1, 3)
+        origin = (self.position[0], self.position[1], self.height)
+        return _solve(origin, self.heading, points.tobytes(), cylindrical)
+
+    def angles(self, target, cylindrical: bool = False) -> tuple[float, float]:
+        """(pan, tilt) for a single target."""
+        pan, tilt = self.solve(target, cylindrical)[0]
+        return float(pan), float(tilt)
+
+    def goto(self, turret, target, cylindrical: bool = False, **kwargs):
+        """Point turret at one target: turret.goto() with the solved
+        angles (kwargs such as sync/coordinated are passed through)."""
+        return turret.goto(*self.angles(target, cylindrical), **kwargs)
+
+
+def cache_info():
+    """Hit/miss statistics of the solve cache."""
+    return _solve.cache_info()
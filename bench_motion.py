@@ -0,0 +1,324 @@
+# bench_motion.py
+#
+# Benchmarks for the motion stack (Shifter -> Stepper -> TurretMotors),
+# run against the simulated GPIO so they work on any Linux box.
+#
+#     python bench_motion.py                        # JSON to stdout
+#     python bench_motion.py -o after.json
+#     python bench_motion.py --baseline before.json # compare, exit 1 on
+#                                                   # a regression > 10%
+#
+# Every result is {"value", "unit", "better"} so two runs can be
+# compared without knowing what each benchmark measures.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import gpio_backend
+
+gpio_backend.use_simulator()
+
+from shifter import Shifter                                    # noqa: E402
+from spi_shifter import LoopbackSPI, SpiShifter                # noqa: E402
+from gpiomem_shifter import GpioMemShifter, make_register_file  # noqa: E402
+from Lab8_4 import Stepper                                     # noqa: E402
+from turret_motors import TurretMotors                         # noqa: E402
+from motion_program import load_program                        # noqa: E402
+from motion_trace import read_trace, replay                    # noqa: E402
+
+
+def result(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def _shifter(num_bits=8):
+    return Shifter(data=16, clock=20, latch=21, num_bits=num_bits)
+
+
+def _rate(fn, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i & 0xFF)
+    return n / (time.perf_counter() - t0)
+
+
+# ---------- benchmarks ----------
+
+IMPORTS = ["shifter", "Lab8_4", "turret_motors", "sockets1", "sockets2"]
+
+
+def bench_import(quick):
+    # Import time of each module in a fresh interpreter, less the
+    # interpreter's own start-up.  Imports must not touch the hardware,
+    # so this also catches module-level GPIO setup or socket binding.
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, ENME441_GPIO="sim")
+
+    def startup(code):
+        times = []
+        for _ in range(3 if quick else 10):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=here, env=env, check=True)
+            times.append(time.perf_counter() - t0)
+        return min(times)
+
+    base = startup("pass")
+    return {f"import.{name}": result((startup(f"import {name}") - base) * 1e3, "ms", "lower")
+            for name in IMPORTS}
+
+
+def bench_shift(quick):
+    n = 2_000 if quick else 20_000
+    out = {}
+    s = Shifter(data=16, clock=20, latch=21)
+    out["shifter.shiftByte"] = result(_rate(s.shiftByte, n), "shifts/s", "higher")
+    out["shifter.write_changing"] = result(_rate(s.write, n), "shifts/s", "higher")
+    out["shifter.write_unchanged"] = result(_rate(lambda i: s.write(0x55), n), "writes/s", "higher")
+
+    spi = SpiShifter(latch=21, spi=LoopbackSPI())
+    out["spi_shifter.shiftByte"] = result(_rate(spi.shiftByte, n), "shifts/s", "higher")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_register_file(os.path.join(tmp, "gpiomem"))
+        mem = GpioMemShifter(data=16, clock=20, latch=21, path=path)
+        out["gpiomem_shifter.shiftByte"] = result(_rate(mem.shiftByte, n), "shifts/s", "higher")
+        mem.cleanup()
+    return out
+
+
+def bench_step(quick):
+    # With no delay the worker steps flat out, so the achieved rate is
+    # the cost of one step (tick bookkeeping + merge + shift).
+    s = _shifter()
+    m = Stepper(s)
+    m.delay = 0
+    deg = 90 if quick else 360
+    plain = m.rotate(deg).report()
+    m.enable_telemetry()
+    recorded = m.rotate(-deg).report()
+    m.close()
+    return {
+        "stepper.step_cost": result(1e6 / plain.rate, "us/step", "lower"),
+        "stepper.step_cost_telemetry": result(1e6 / recorded.rate, "us/step", "lower"),
+    }
+
+
+def bench_start_latency(quick):
+    s = _shifter()
+    m = Stepper(s)
+    m.goAngle(1).wait()           # start the worker outside the timing
+    samples = []
+    for k in range(20 if quick else 100):
+        before = m.position
+        t0 = time.perf_counter()
+        h = m.goAngle(2.0 if k % 2 == 0 else 0.0)
+        while m.position == before:
+            time.sleep(0)   # yield: on one core a tight spin starves the worker
+        samples.append((time.perf_counter() - t0) * 1e6)
+        h.wait()
+    m.close()
+    return {
+        "stepper.start_latency_median": result(statistics.median(samples), "us", "lower"),
+        "stepper.start_latency_max": result(max(samples), "us", "lower"),
+    }
+
+
+def bench_two_motors(quick):
+    # Two motors on one shifter at the nominal rate: both should reach
+    # it, with no more late steps than one motor alone.
+    deg = 45 if quick else 180
+    s = _shifter()
+    m1, m2 = Stepper(s), Stepper(s)
+    solo = m1.rotate(deg).report()
+    h1, h2 = m1.rotate(deg), m2.rotate(-deg)
+    r1, r2 = h1.report(), h2.report()
+    m1.close()
+    out = {
+        "two_motors.solo_rate": result(solo.rate, "steps/s", "higher"),
+        "two_motors.rate_ratio": result(min(r1.rate, r2.rate) / solo.rate, "x solo", "higher"),
+        "two_motors.late_steps": result(r1.late_steps + r2.late_steps, "steps", "lower"),
+        "two_motors.max_late": result(max(r1.max_late, r2.max_late) * 1e6, "us", "lower"),
+    }
+    return out
+
+
+def bench_chain(quick):
+    # Four motors on two chained registers: one worker, one shift per
+    # tick for all of them, so each should keep close to the solo rate.
+    deg = 45 if quick else 180
+    s = _shifter(num_bits=16)
+    motors = [Stepper(s) for _ in range(4)]
+    handles = [m.rotate(deg if k % 2 else -deg) for k, m in enumerate(motors)]
+    reports = [h.report() for h in handles]
+    motors[0].close()
+    nominal = reports[0].nominal_rate
+    return {
+        "chain4.aggregate_rate": result(sum(r.rate for r in reports), "steps/s", "higher"),
+        "chain4.rate_ratio": result(min(r.rate for r in reports) / nominal, "x nominal", "higher"),
+        "chain4.late_steps": result(sum(r.late_steps for r in reports), "steps", "lower"),
+    }
+
+
+PROGRAM = """
+parallel
+    goto m1 90
+    goto m2 -90
+end
+parallel
+    goto m1 -45
+    goto m2 45
+end
+goto m1 -135
+goto m1 135
+goto m1 0
+"""
+
+
+def bench_program(quick):
+    # Compile cost of a motion program versus loading it from the cache.
+    s = _shifter()
+    motors = {'m1': Stepper(s), 'm2': Stepper(s)}
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        timeline = load_program(PROGRAM, motors, cache_dir=tmp)
+        t1 = time.perf_counter()
+        load_program(PROGRAM, motors, cache_dir=tmp)
+        t2 = time.perf_counter()
+    return {
+        "program.compile": result((t1 - t0) * 1e3, "ms", "lower"),
+        "program.cached_load": result((t2 - t1) * 1e3, "ms", "lower"),
+        "program.shifts": result(len(timeline.times), "shifts", "lower"),
+    }
+
+
+def bench_replay(quick):
+    # Record a short two-motor session, then replay its shift words:
+    # flat out (shift-path throughput) and at the original timing.
+    deg = 30 if quick else 120
+    s = _shifter()
+    m1, m2 = Stepper(s), Stepper(s)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "session.trace")
+        m1.start_recording(path)
+        h1, h2 = m1.rotate(deg), m2.rotate(-deg)
+        h1.wait()
+        h2.wait()
+        m1.stop_recording()
+        session = read_trace(path)[-1]
+    m1.close()
+    fast = replay(session, _shifter(), speed=None)
+    timed = replay(session, _shifter(), speed=1.0)
+    return {
+        "replay.fast_rate": result(fast.shifts / fast.duration, "shifts/s", "higher"),
+        "replay.max_late": result(timed.max_late * 1e6, "us", "lower"),
+    }
+
+
+def bench_turret_goto(quick):
+    turret = TurretMotors(data_pin=16, latch_pin=20, clock_pin=21)
+    targets = [(30, 10), (-30, 20), (0, 0)] if quick else [(90, 30), (-90, 10), (45, 45), (0, 0)]
+    times = []
+    planned = []
+    for pan, tilt in targets:
+        plan = turret.plan_goto(pan, tilt)
+        t0 = time.perf_counter()
+        turret.goto(pan, tilt, coordinated=True)
+        times.append(time.perf_counter() - t0)
+        planned.append(plan.duration)
+    turret.pan.close()
+    return {
+        "turret.goto_total": result(sum(times), "s", "lower"),
+        "turret.goto_overhead": result((sum(times) - sum(planned)) / len(times) * 1e3, "ms/move", "lower"),
+    }
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "shift": bench_shift,
+    "step": bench_step,
+    "start_latency": bench_start_latency,
+    "two_motors": bench_two_motors,
+    "chain": bench_chain,
+    "program": bench_program,
+    "replay": bench_replay,
+    "turret_goto": bench_turret_goto,
+}
+
+
+# ---------- runner ----------
+
+def run(names, quick):
+    results = {}
+    for name in names:
+        results.update(BENCHMARKS[name](quick))
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print a comparison table; return the names that regressed by more
+    than threshold (a fraction)."""
+    regressions = []
+    base = baseline["results"]
+    print(f"{'benchmark':36} {'baseline':>12} {'current':>12} {'change':>8}", file=sys.stderr)
+    for name, cur in current["results"].items():
+        if name not in base:
+            continue
+        old, new = base[name]["value"], cur["value"]
+        if old == 0:
+            continue
+        change = (new - old) / abs(old)
+        worse = -change if cur["better"] == "higher" else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"{name:36} {old:12.4g} {new:12.4g} {change:+8.1%}{flag}", file=sys.stderr)
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Motion-stack benchmarks (simulated GPIO).")
+    ap.add_argument("benchmarks", nargs="*", metavar="NAME",
+                    help=f"which benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    ap.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    ap.add_argument("--baseline", help="JSON results to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10,
+                    help="regression threshold as a fraction (default 0.10)")
+    ap.add_argument("--quick", action="store_true", help="smaller runs, for smoke tests")
+    args = ap.parse_args(argv)
+    unknown = [b for b in args.benchmarks if b not in BENCHMARKS]
+    if unknown:
+        ap.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    current = run(args.benchmarks or list(BENCHMARKS), args.quick)
+    text = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,7 +12,7 @@ ENME441 Lab 6 – Steps 4–6
 
 import time
 import random
-import RPi.GPIO as GPIO
+from gpio_backend import GPIO
 from shifter import Shifter
 
 # ---------- Wiring (BCM numbering) ----------
@@ -0,0 +1,340 @@
+# gpio_backend.py
+#
+# Pluggable GPIO backend for the lab modules.
+#
+# Every module imports GPIO from here instead of RPi.GPIO:
+#
+#     from gpio_backend import GPIO
+#
+# By default this forwards to RPi.GPIO.  When the environment variable
+# ENME441_GPIO=sim is set (or after use_simulator()) it forwards to
+# SimGPIO, an in-memory stand-in that records every pin transition with
+# a monotonic timestamp.  That lets us benchmark and profile the shift
+# register / stepper / PWM code on a plain Linux box.  The simulator is
+# never picked silently: if RPi.GPIO can't be loaded, the first GPIO
+# call raises, so a broken install on a Pi doesn't "run" with no motor
+# moving.
+#
+# Steppers are stepped by their scheduler's worker process, which has
+# its own copy of the simulator.  To see those edges in the parent, give
+# the simulator a shared trace: use_simulator(shared=N) logs the first
+# N transitions to shared memory.
+#
+# Example:
+#
+#     import gpio_backend
+#     sim = gpio_backend.use_simulator()
+#     s = Shifter(data=16, clock=20, latch=21)
+#     s.shiftByte(0xA5)
+#     print(len(sim.trace), sim.trace.rate(20))   # transitions, clock edges/s
+#
+#     sim = gpio_backend.use_simulator(shared=1_000_000)
+#     Stepper(s).rotate(90).wait()
+#     print(sim.trace.rate(21))                   # latches/s, from the worker
+
+import multiprocessing
+import os
+from array import array
+from time import perf_counter_ns
+
+
+class PinTrace:
+    """
+    Compact, array-backed log of pin events.
+
+    Each event is (t_ns, pin, value) stored in three parallel arrays,
+    so millions of edges cost a few bytes each instead of a tuple apiece.
+    """
+
+    def __init__(self, value_type: str = 'B'):
+        self.t_ns = array('q')
+        self.pin = array('B')
+        self.value = array(value_type)
+        self.enabled = True
+
+    def __len__(self) -> int:
+        return len(self.t_ns)
+
+    def record(self, pin: int, value) -> None:
+        if self.enabled:
+            self.t_ns.append(perf_counter_ns())
+            self.pin.append(pin)
+            self.value.append(value)
+
+    def clear(self) -> None:
+        del self.t_ns[:]
+        del self.pin[:]
+        del self.value[:]
+
+    def events(self, pin: int | None = None):
+        """Yield (t_ns, pin, value) tuples, optionally for a single pin."""
+        for t, p, v in zip(self.t_ns, self.pin, self.value):
+            if pin is None or p == pin:
+                yield t, p, v
+
+    def count(self, pin: int, value=None) -> int:
+        """Number of events on a pin (optionally only those to `value`)."""
+        return sum(1 for _, _, v in self.events(pin) if value is None or v == value)
+
+    def rate(self, pin: int, value=1) -> float:
+        """Events per second on a pin between its first and last event."""
+        times = [t for t, _, v in self.events(pin) if value is None or v == value]
+        if len(times) < 2:
+            return 0.0
+        return (len(times) - 1) * 1e9 / (times[-1] - times[0])
+
+
+class SharedPinTrace(PinTrace):
+    """
+    PinTrace in shared memory, so events recorded by forked processes
+    (the step scheduler worker) are visible to all of them.  Keeps the
+    first `capacity` events and counts the rest in `dropped`.  One
+    process should record at a time.
+    """
+
+    def __init__(self, value_type: str = 'B', capacity: int = 1_000_000):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._t_ns = multiprocessing.RawArray('q', capacity)
+        self._pin = multiprocessing.RawArray('B', capacity)
+        self._value = multiprocessing.RawArray(value_type, capacity)
+        self._head = multiprocessing.RawValue('q', 0)
+        self._dropped = multiprocessing.RawValue('q', 0)
+        self.enabled = True
+
+    # the recorded part, as lists (PinTrace has arrays)
+
+    @property
+    def t_ns(self):
+        return self._t_ns[:self._head.value]
+
+    @property
+    def pin(self):
+        return self._pin[:self._head.value]
+
+    @property
+    def value(self):
+        return self._value[:self._head.value]
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped.value
+
+    def __len__(self) -> int:
+        return self._head.value
+
+    def record(self, pin: int, value) -> None:
+        if self.enabled:
+            n = self._head.value
+            if n >= self.capacity:
+                self._dropped.value += 1
+                return
+            self._t_ns[n] = perf_counter_ns()
+            self._pin[n] = pin
+            self._value[n] = value
+            self._head.value = n + 1
+
+    def clear(self) -> None:
+        self._head.value = 0
+        self._dropped.value = 0
+
+    def events(self, pin: int | None = None):
+        """Yield (t_ns, pin, value) tuples, optionally for a single pin."""
+        n = self._head.value
+        for t, p, v in zip(self._t_ns[:n], self._pin[:n], self._value[:n]):
+            if pin is None or p == pin:
+                yield t, p, v
+
+
+class SimPWM:
+    """Stand-in for RPi.GPIO.PWM; duty/frequency changes go to a PinTrace."""
+
+    def __init__(self, gpio: "SimGPIO", pin: int, frequency: float):
+        self._gpio = gpio
+        self.pin = pin
+        self.frequency = float(frequency)
+        self.duty = 0.0
+        self.running = False
+
+    def start(self, duty: float) -> None:
+        self.running = True
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty: float) -> None:
+        if not 0.0 <= duty <= 100.0:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.duty = float(duty)
+        self._gpio.pwm_trace.record(self.pin, self.duty)
+
+    def ChangeFrequency(self, frequency: float) -> None:
+        if frequency <= 0.0:
+            raise ValueError("frequency must be greater than 0.0")
+        self.frequency = float(frequency)
+
+    def stop(self) -> None:
+        if self.running:
+            self.running = False
+            self._gpio.pwm_trace.record(self.pin, 0.0)
+
+
+class SimGPIO:
+    """
+    In-memory implementation of the subset of RPi.GPIO the labs use.
+
+    Only real transitions are logged to `trace`: writing the level a pin
+    already has costs a call but produces no edge, exactly like hardware.
+    `calls` counts every output() call so redundant writes can be measured.
+    With shared=N the traces are SharedPinTraces of N events, which also
+    hold what forked processes recorded.
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, shared: int = 0):
+        if shared:
+            self.trace = SharedPinTrace('B', shared)
+            self.pwm_trace = SharedPinTrace('f', shared)
+        else:
+            self.trace = PinTrace('B')
+            self.pwm_trace = PinTrace('f')
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self.calls = 0
+        self._callbacks = {}
+
+    # ---------- RPi.GPIO API ----------
+
+    def setmode(self, mode) -> None:
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setwarnings(self, flag) -> None:
+        pass
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=LOW) -> None:
+        for p in (pin if isinstance(pin, (list, tuple)) else (pin,)):
+            self.directions[p] = direction
+            if direction == self.OUT:
+                self.levels[p] = 1 if initial else 0
+            else:
+                self.levels[p] = 1 if pull_up_down == self.PUD_UP else 0
+
+    def output(self, pin, value) -> None:
+        self.calls += 1
+        value = 1 if value else 0
+        if self.levels.get(pin) != value:
+            self.levels[pin] = value
+            self.trace.record(pin, value)
+
+    def input(self, pin) -> int:
+        return self.levels.get(pin, 0)
+
+    def PWM(self, pin, frequency) -> SimPWM:
+        return SimPWM(self, pin, frequency)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None) -> None:
+        self._callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin) -> None:
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None) -> None:
+        if pin is None:
+            pins = list(self.directions)
+        else:
+            pins = pin if isinstance(pin, (list, tuple)) else [pin]
+        for p in pins:
+            self.directions.pop(p, None)
+            self.levels.pop(p, None)
+            self._callbacks.pop(p, None)
+
+    # ---------- simulation helpers ----------
+
+    def set_input(self, pin, value) -> None:
+        """Drive an input pin from the outside (buttons, sensors)."""
+        value = 1 if value else 0
+        old = self.levels.get(pin, 0)
+        self.levels[pin] = value
+        if old == value or pin not in self._callbacks:
+            return
+        edge, callback = self._callbacks[pin]
+        rising = value == 1
+        if callback and (edge == self.BOTH or (edge == self.RISING) == rising):
+            callback(pin)
+
+    def reset_trace(self) -> None:
+        self.trace.clear()
+        self.pwm_trace.clear()
+        self.calls = 0
+
+
+class _GPIOProxy:
+    """
+    Module-like object that forwards to whichever backend is active,
+    so `from gpio_backend import GPIO` keeps working after a switch.
+    """
+
+    def __getattr__(self, name):
+        return getattr(active(), name)
+
+    def __repr__(self):
+        return f"<GPIO proxy -> {active()!r}>"
+
+
+_backend = None
+
+
+def _load_default():
+    if os.environ.get("ENME441_GPIO", "").lower() == "sim":
+        return SimGPIO()
+    try:
+        from RPi import GPIO as rpi_gpio
+    except (ImportError, RuntimeError) as e:
+        # Not on a Pi, a broken install or no /dev/gpiomem access.
+        raise RuntimeError(f"RPi.GPIO is not usable ({e}); set ENME441_GPIO=sim "
+                           "to run against the simulator") from e
+    return rpi_gpio
+
+
+def active():
+    """Return the backend module/object currently behind GPIO."""
+    global _backend
+    if _backend is None:
+        _backend = _load_default()
+    return _backend
+
+
+def use_backend(backend):
+    """Install any RPi.GPIO-compatible object as the active backend."""
+    global _backend
+    _backend = backend
+    return backend
+
+
+def use_simulator(shared: int = 0) -> SimGPIO:
+    """Switch to a fresh SimGPIO and return it (for its trace).  shared=N
+    keeps the first N pin events in shared memory, including those made
+    by the step scheduler's worker process."""
+    return use_backend(SimGPIO(shared))
+
+
+def is_simulated() -> bool:
+    return isinstance(active(), SimGPIO)
+
+
+GPIO = _GPIOProxy()
@@ -0,0 +1,175 @@
+# gpiomem_shifter.py
+#
+# Bit-banged 74HC595 driver that writes the GPIO SET/CLR registers
+# directly through an mmap of /dev/gpiomem.
+#
+# Every clock, data and latch edge is a single 32-bit memory store
+# (no RPi.GPIO call, no sleep(0)), and the stores needed for each byte
+# are precomputed once, so shifting a byte is just a loop over a tuple
+# of (register, mask) pairs.  Use this when the SPI pins are taken and
+# SpiShifter cannot be used.
+#
+# Register layout is the BCM2835/2836/2837/2711 one (Pi 1-4).  The Pi 5
+# (RP1) has a different GPIO block and is not supported.
+#
+# Any 4 KiB file works in place of /dev/gpiomem, which is how the tests
+# and benchmarks run it off-Pi:
+#
+#     make_register_file("/tmp/gpiomem")
+#     s = GpioMemShifter(data=16, clock=20, latch=21, path="/tmp/gpiomem")
+#     s.shiftByte(0xA5)
+
+import mmap
+import os
+from shifter import Shifter
+
+BLOCK_SIZE = 4096
+
+# Register word indexes (byte offset / 4)
+GPFSEL0 = 0x00 // 4
+GPSET0 = 0x1C // 4
+GPCLR0 = 0x28 // 4
+GPLEV0 = 0x34 // 4
+
+
+def make_register_file(path: str) -> str:
+    """Create a zero-filled file the size of the GPIO block (test stand-in)."""
+    with open(path, 'wb') as f:
+        f.write(bytes(BLOCK_SIZE))
+    return path
+
+
+def _byte_programs(data_mask, clock_mask):
+    """
+    Precompute the store sequence for every (byte, data level) pair.
+
+    Bits go out bit 0 first, like Shifter.  Each bit is: an optional
+    data store (only when the level changes), clock high, clock low.
+    The clock-low store also clears the data pin when the next bit needs
+    it, so a 0 after a 1 costs no extra store.
+
+    Returns programs[level][byte] = (stores, level_after), where stores
+    is a tuple of (register index, mask) pairs.
+    """
+    programs = ([], [])
+    for start in (0, 1):
+        for byte in range(256):
+            stores = []
+            level = start
+            for i in range(8):
+                bit = (byte >> i) & 1
+                if bit != level:
+                    if bit:
+                        stores.append((GPSET0, data_mask))
+                    elif stores and stores[-1] == (GPCLR0, clock_mask):
+                        stores[-1] = (GPCLR0, clock_mask | data_mask)
+                    else:
+                        stores.append((GPCLR0, data_mask))
+                    level = bit
+                stores.append((GPSET0, clock_mask))
+                stores.append((GPCLR0, clock_mask))
+            programs[start].append((tuple(stores), level))
+    return programs
+
+
+def replay_stores(stores, data, clock, latch, num_bits=8):
+    """
+    Emulate the SET/CLR registers for a list of stores and return the
+    words latched, in order.  Lets tests check the precomputed programs.
+    """
+    level = 0
+    register = 0
+    latched = []
+    mask_all = (1 << num_bits) - 1
+    for reg, mask in stores:
+        if reg == GPSET0:
+            if mask & (1 << data):
+                level = 1
+            if mask & (1 << clock):
+                # the first bit shifted in ends up as bit 0 of the word
+                register = ((register >> 1) | (level << (num_bits - 1))) & mask_all
+            if mask & (1 << latch):
+                latched.append(register)
+        elif reg == GPCLR0 and mask & (1 << data):
+            level = 0
+    return latched
+
+
+class GpioMemShifter(Shifter):
+
+    def __init__(self, data, clock, latch, path="/dev/gpiomem", num_bits=8):
+        """
+        data, clock, latch:
+            BCM pin numbers (0-31) wired to SER, SRCLK and RCLK.
+        path:
+            /dev/gpiomem on a Pi, or a 4 KiB file as a stand-in.
+        num_bits:
+            width of the register chain (8 per 74HC595).
+        """
+        for p in (data, clock, latch):
+            if not 0 <= p < 32:
+                raise ValueError(f"pin {p} is not in GPIO bank 0 (0-31)")
+        self.dataPin = data
+        self.latchPin = latch
+        self.clockPin = clock
+        self._init_frame(num_bits)
+        self.path = path
+        self._data_mask = 1 << data
+        self._clock_mask = 1 << clock
+        self._latch_mask = 1 << latch
+        self._programs = _byte_programs(self._data_mask, self._clock_mask)
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_SYNC)
+        try:
+            self._mem = mmap.mmap(fd, BLOCK_SIZE, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self._regs = memoryview(self._mem).cast('I')
+        for p in (self.dataPin, self.clockPin, self.latchPin):
+            self._set_output(p)
+        self._regs[GPCLR0] = self._data_mask | self._clock_mask | self._latch_mask
+        self._state[2] = 0
+
+    def _set_output(self, pin):
+        # GPFSELn holds 3 function bits per pin; 0b001 = output
+        reg = GPFSEL0 + pin // 10
+        shift = (pin % 10) * 3
+        self._regs[reg] = (self._regs[reg] & ~(0b111 << shift)) | (0b001 << shift)
+
+    def ping(self, p):  # ping the clock or latch pin
+        mask = 1 << p
+        self._regs[GPSET0] = mask
+        self._regs[GPCLR0] = mask
+
+    def store_sequence(self, dataword, num_bits, level=0):
+        """The stores _shift_bits would issue (for tests and benchmarks)."""
+        stores = []
+        programs = self._programs
+        for k in range(num_bits // 8):
+            prog, level = programs[level][(dataword >> (8 * k)) & 0xFF]
+            stores.extend(prog)
+        stores.append((GPSET0, self._latch_mask))
+        stores.append((GPCLR0, self._latch_mask))
+        return stores
+
+    def _shift_bits(self, dataword, num_bits):
+        # num_bits is a whole number of bytes here (shiftWord pads)
+        regs = self._regs
+        programs = self._programs
+        state = self._state
+        level = 1 if state[2] == 1 else 0
+        if state[2] == -1:
+            regs[GPCLR0] = self._data_mask
+        for k in range(num_bits // 8):
+            prog, level = programs[level][(dataword >> (8 * k)) & 0xFF]
+            for reg, mask in prog:
+                regs[reg] = mask
+        state[2] = level
+        regs[GPSET0] = self._latch_mask
+        regs[GPCLR0] = self._latch_mask
+
+    def _close(self):
+        self._regs.release()
+        self._mem.close()
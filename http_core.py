@@ -0,0 +1,364 @@
+# http_core.py
+#
+# Small HTTP/1.1 server core for the LED control pages (sockets1.py,
+# sockets2.py).
+#
+# One thread, one selectors loop, non-blocking sockets: any number of
+# browsers can be connected at once, and each connection is kept open
+# between requests (HTTP/1.1 keep-alive), so a slider firing POSTs
+# does not pay a TCP handshake per update or wait behind other clients.
+# Requests are read until the headers and Content-Length bytes of body
+# have arrived, however many recv() calls that takes, and pipelined
+# requests are answered in order.
+#
+# The application is just a function from the raw request text to the
+# raw response bytes, which is what the existing handle_request()
+# routes already are.  Responses should carry Content-Length and no
+# "Connection: close"; the core adds that header itself when it is
+# about to close (client asked for it, HTTP/1.0, or a bad request).
+#
+# Paths listed in `websockets` also accept a WebSocket upgrade (RFC
+# 6455).  After the handshake the connection carries frames instead of
+# requests: each complete message (text or binary) is passed to that
+# path's function as bytes, and whatever it returns (bytes, str or None)
+# is sent back as a message.  Ping/pong and close are handled here.  A
+# slider update is then a few bytes of frame instead of a full request.
+#
+# Example:
+#
+#     server = HttpServer(handle_request, port=8080,
+#                         websockets={"/ws": handle_message})
+#     try:
+#         server.serve_forever()
+#     except KeyboardInterrupt:
+#         pass
+#     finally:
+#         server.close()
+
+import base64
+import hashlib
+import selectors
+import socket
+import struct
+import time
+
+MAX_HEADER = 16 * 1024       # bytes of request line + headers we accept
+MAX_BODY = 1024 * 1024       # bytes of request body we accept
+IDLE_TIMEOUT = 30.0          # s before an idle keep-alive connection is closed
+                             # (WebSocket connections stay open while idle)
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_CONT, WS_TEXT, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def _error(status: str) -> bytes:
+    body = status.encode()
+    return (
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Content-Type: text/plain\r\n\r\n"
+    ).encode() + body
+
+
+def ws_accept(key: str) -> str:
+    """Sec-WebSocket-Accept value for a client's Sec-WebSocket-Key."""
+    digest = hashlib.sha1((key + WS_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def ws_frame(opcode: int, payload: bytes = b"") -> bytes:
+    """One unmasked, final server-to-client frame."""
+    n = len(payload)
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return head + payload
+
+
+class _Connection:
+    """Per-client buffers and state."""
+
+    __slots__ = ('sock', 'inbuf', 'outbuf', 'last_active', 'closing', 'ws', 'message')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.last_active = time.monotonic()
+        self.closing = False   # close once outbuf is sent
+        self.ws = None         # message function once upgraded to a WebSocket
+        self.message = None    # (opcode, bytearray) of a fragmented message
+
+
+class HttpServer:
+
+    def __init__(self, handler, host: str = "", port: int = 8080, backlog: int = 128,
+                 websockets: dict | None = None):
+        """
+        handler:
+            function(request_text) -> response bytes, called once per
+            complete request (request line, headers and body).
+        host, port:
+            address to listen on.
+        websockets:
+            {path: function(message bytes) -> reply bytes/str or None}
+            for paths that accept a WebSocket upgrade.
+        """
+        self.handler = handler
+        self.websockets = dict(websockets or {})
+        self.sel = selectors.DefaultSelector()
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(backlog)
+        self.listener.setblocking(False)
+        self.sel.register(self.listener, selectors.EVENT_READ, None)
+        self.connections = {}  # socket -> _Connection
+        self.requests = 0      # requests answered so far
+        self.messages = 0      # WebSocket messages handled so far
+        self._running = False
+
+    @property
+    def port(self) -> int:
+        return self.listener.getsockname()[1]
+
+    # ---------- event loop ----------
+
+    def serve_forever(self, poll: float = 1.0) -> None:
+        """Serve until stop() or close() (from a handler or another thread)."""
+        self._running = True
+        while self._running:
+            for key, events in self.sel.select(timeout=poll):
+                if key.data is None:
+                    self._accept()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(conn)
+                if events & selectors.EVENT_WRITE and conn.sock in self.connections:
+                    self._write(conn)
+            self._close_idle()
+
+    def stop(self) -> None:
+        self._running = False
+
+    def close(self) -> None:
+        """Stop serving and close every connection and the listener."""
+        self._running = False
+        for conn in list(self.connections.values()):
+            self._drop(conn)
+        if self.listener.fileno() != -1:
+            self.sel.unregister(self.listener)
+            self.listener.close()
+        self.sel.close()
+
+    # ---------- connections ----------
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(sock)
+            self.connections[sock] = conn
+            self.sel.register(sock, selectors.EVENT_READ, conn)
+
+    def _drop(self, conn: _Connection) -> None:
+        if self.connections.pop(conn.sock, None) is None:
+            return
+        self.sel.unregister(conn.sock)
+        conn.sock.close()
+
+    def _close_idle(self) -> None:
+        cutoff = time.monotonic() - IDLE_TIMEOUT
+        for conn in list(self.connections.values()):
+            if conn.ws is None and conn.last_active < cutoff:
+                self._drop(conn)
+
+    def _read(self, conn: _Connection) -> None:
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._drop(conn)  # client went away
+            return
+        conn.last_active = time.monotonic()
+        if conn.closing:
+            return  # already answering with a close: ignore the rest
+        conn.inbuf += data
+        self._process(conn)
+        if conn.outbuf:
+            self._write(conn)
+
+    def _write(self, conn: _Connection) -> None:
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop(conn)
+            return
+        del conn.outbuf[:sent]
+        if conn.outbuf:
+            # the rest goes out when the socket is writable again
+            self.sel.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+        elif conn.closing:
+            self._drop(conn)
+        else:
+            self.sel.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    # ---------- requests ----------
+
+    def _process(self, conn: _Connection) -> None:
+        """Answer every complete request in conn.inbuf."""
+        while not conn.closing:
+            if conn.ws is not None:
+                self._process_frames(conn)
+                return
+            end = conn.inbuf.find(b"\r\n\r\n")
+            if end < 0:
+                if len(conn.inbuf) > MAX_HEADER:
+                    self._respond(conn, _error("431 Request Header Fields Too Large"), close=True)
+                return
+            head = conn.inbuf[:end].decode("latin-1")
+            lines = head.split("\r\n")
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get("content-length", "0"))
+            except ValueError:
+                length = -1
+            if not 0 <= length <= MAX_BODY:
+                self._respond(conn, _error("400 Bad Request"), close=True)
+                return
+            total = end + 4 + length
+            if len(conn.inbuf) < total:
+                return  # wait for the rest of the body
+            request = conn.inbuf[:total].decode("utf-8", "replace")
+            del conn.inbuf[:total]
+
+            request_line = lines[0].split(" ")
+            if (len(request_line) == 3 and request_line[0] == "GET"
+                    and request_line[1] in self.websockets
+                    and headers.get("upgrade", "").lower() == "websocket"
+                    and "sec-websocket-key" in headers):
+                self._upgrade(conn, request_line[1], headers["sec-websocket-key"])
+                continue
+
+            version = lines[0].rsplit(" ", 1)[-1]
+            connection = headers.get("connection", "").lower()
+            if version == "HTTP/1.0":
+                close = connection != "keep-alive"
+            else:
+                close = connection == "close"
+            try:
+                response = self.handler(request)
+            except Exception:
+                response = _error("500 Internal Server Error")
+            self.requests += 1
+            if version == "HTTP/1.0" and not close:
+                response = response.replace(b"\r\n", b"\r\nConnection: keep-alive\r\n", 1)
+            self._respond(conn, response, close)
+
+    def _respond(self, conn: _Connection, response: bytes, close: bool = False) -> None:
+        if close:
+            response = response.replace(b"\r\n", b"\r\nConnection: close\r\n", 1)
+            conn.closing = True
+        conn.outbuf += response
+
+    # ---------- WebSocket ----------
+
+    def _upgrade(self, conn: _Connection, path: str, key: str) -> None:
+        conn.outbuf += (
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {ws_accept(key)}\r\n\r\n"
+        ).encode()
+        conn.ws = self.websockets[path]
+        self.requests += 1
+
+    def _ws_close(self, conn: _Connection, code: int) -> None:
+        conn.outbuf += ws_frame(WS_CLOSE, struct.pack("!H", code))
+        conn.closing = True
+
+    def _process_frames(self, conn: _Connection) -> None:
+        """Handle every complete frame in conn.inbuf."""
+        buf = conn.inbuf
+        while not conn.closing and len(buf) >= 2:
+            fin, opcode = buf[0] & 0x80, buf[0] & 0x0F
+            masked, n = buf[1] & 0x80, buf[1] & 0x7F
+            offset = 2
+            if n == 126:
+                if len(buf) < 4:
+                    return
+                n = struct.unpack_from("!H", buf, 2)[0]
+                offset = 4
+            elif n == 127:
+                if len(buf) < 10:
+                    return
+                n = struct.unpack_from("!Q", buf, 2)[0]
+                offset = 10
+            if not masked:
+                self._ws_close(conn, 1002)  # clients must mask their frames
+                return
+            if n > MAX_BODY:
+                self._ws_close(conn, 1009)
+                return
+            if len(buf) < offset + 4 + n:
+                return  # wait for the rest of the frame
+            mask = buf[offset:offset + 4]
+            start = offset + 4
+            payload = bytes(b ^ mask[i & 3] for i, b in enumerate(buf[start:start + n]))
+            del buf[:start + n]
+
+            if opcode == WS_PING:
+                conn.outbuf += ws_frame(WS_PONG, payload)
+            elif opcode == WS_PONG:
+                pass
+            elif opcode == WS_CLOSE:
+                conn.outbuf += ws_frame(WS_CLOSE, payload[:2])
+                conn.closing = True
+            elif opcode in (WS_TEXT, WS_BINARY, WS_CONT):
+                if opcode == WS_CONT:
+                    if conn.message is None:
+                        self._ws_close(conn, 1002)
+                        return
+                    conn.message[1].extend(payload)
+                elif conn.message is not None:
+                    self._ws_close(conn, 1002)  # new message inside a fragmented one
+                    return
+                else:
+                    conn.message = (opcode, bytearray(payload))
+                if len(conn.message[1]) > MAX_BODY:
+                    self._ws_close(conn, 1009)
+                    return
+                if fin:
+                    message = conn.message[1]
+                    conn.message = None
+                    self._message(conn, bytes(message))
+            else:
+                self._ws_close(conn, 1002)
+
+    def _message(self, conn: _Connection, message: bytes) -> None:
+        try:
+            reply = conn.ws(message)
+        except Exception:
+            self._ws_close(conn, 1011)
+            return
+        self.messages += 1
+        if isinstance(reply, str):
+            conn.outbuf += ws_frame(WS_TEXT, reply.encode())
+        elif reply is not None:
+            conn.outbuf += ws_frame(WS_BINARY, bytes(reply))
@@ -0,0 +1,137 @@
+# motion_profiles.py
+#
+# Acceleration profiles for the steppers.
+#
+# Stepping at a constant rate means picking a speed the motor can reach
+# from standstill, which makes long slews slow.  A MotionProfile starts
+# at a safe pull-in rate, accelerates up to max_velocity and brakes
+# symmetrically at the end of the move:
+#
+#   - trapezoidal:  constant acceleration (jerk=None)
+#   - S-curve:      acceleration ramps in and out at the given jerk
+#
+# Units are motor steps: steps/s, steps/s^2, steps/s^3.
+#
+# delay_table() turns a profile and a move length into per-step delays
+# (microseconds) with NumPy, once, and caches the result by move length,
+# so the step loop only indexes a precomputed table.
+#
+# Example:
+#
+#     m.profile = MotionProfile(max_velocity=1600, acceleration=4000)
+#     m.goAngle(180)      # ramps 833 -> 1600 steps/s and back down
+
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+
+
+class MotionProfile(NamedTuple):
+    max_velocity: float                 # steps/s
+    acceleration: float                 # steps/s^2
+    jerk: float | None = None           # steps/s^3, None = trapezoidal
+    start_velocity: float = 1e6 / 1200  # steps/s we can start/stop at
+
+    def delays(self, num_steps: int) -> np.ndarray:
+        """Per-step delays in microseconds for a move of num_steps."""
+        return delay_table(self, num_steps)
+
+    def move_time(self, num_steps: int) -> float:
+        """Duration of a move of num_steps, in seconds."""
+        if num_steps <= 0:
+            return 0.0
+        return float(delay_table(self, num_steps).sum()) / 1e6
+
+
+@lru_cache(maxsize=32)
+def _accel_curve(p: MotionProfile, samples: int = 2048):
+    """
+    Velocity reached after travelling s steps while speeding up from
+    start_velocity to max_velocity.  Returns (s, v) sample arrays.
+    """
+    v0 = min(p.start_velocity, p.max_velocity)
+    dv = p.max_velocity - v0
+    a = p.acceleration
+    if dv <= 0:
+        return np.array([0.0, 1.0]), np.array([v0, v0])
+    if p.jerk is None:
+        t_ramp = dv / a
+        t = np.linspace(0.0, t_ramp, samples)
+        acc = np.full(samples, a)
+    else:
+        j = p.jerk
+        if dv >= a * a / j:
+            t_j = a / j                 # time to ramp accel in (and out)
+            t_c = dv / a - t_j          # time at full accel
+        else:
+            t_j = np.sqrt(dv / j)       # never reaches full accel
+            t_c = 0.0
+        t_ramp = 2 * t_j + t_c
+        t = np.linspace(0.0, t_ramp, samples)
+        acc = np.minimum.reduce([j * t, np.full(samples, j * t_j), j * (t_ramp - t)])
+        acc = np.minimum(acc, a)
+    dt = np.diff(t)
+    v = v0 + np.concatenate(([0.0], np.cumsum((acc[1:] + acc[:-1]) / 2 * dt)))
+    s = np.concatenate(([0.0], np.cumsum((v[1:] + v[:-1]) / 2 * dt)))
+    return s, v
+
+
+@lru_cache(maxsize=256)
+def delay_table(profile: MotionProfile, num_steps: int,
+                entry_velocity: float | None = None) -> np.ndarray:
+    """
+    Per-step delays (microseconds) for a move of num_steps.
+
+    The speed at each step is the lower of the speed-up curve from the
+    start and the (mirrored) slow-down curve to the end, so short moves
+    get a triangular profile and long ones a plateau at max_velocity.
+    entry_velocity starts the move already moving (a retargeted move
+    picking up where the old one left off) instead of from standstill.
+    Cached by arguments; the returned array is read-only.
+    """
+    if num_steps <= 0:
+        return np.zeros(0)
+    s_curve, v_curve = _accel_curve(profile)
+    pos = np.arange(num_steps) + 0.5
+    up = pos
+    if entry_velocity is not None:
+        # join the speed-up curve at the point where it reaches entry_velocity
+        # (the slow-down curve still ends at this move's last step)
+        up = pos + np.interp(entry_velocity, v_curve, s_curve)
+    v_up = np.interp(up, s_curve, v_curve, right=profile.max_velocity)
+    v_down = np.interp(num_steps - pos, s_curve, v_curve, right=profile.max_velocity)
+    table = 1e6 / np.minimum(v_up, v_down)
+    table.setflags(write=False)
+    return table
+
+
+def move_times(profile: MotionProfile, num_steps) -> np.ndarray:
+    """
+    Vectorised move_time(): durations (s) for an array of move lengths,
+    from the speed-up curve directly instead of building delay tables.
+    Used to fill cost matrices.
+    """
+    n = np.abs(np.asarray(num_steps, dtype=float))
+    s_curve, v_curve = _accel_curve(profile)
+    t_curve = np.concatenate(([0.0], np.cumsum(np.diff(s_curve) * 2 / (v_curve[1:] + v_curve[:-1]))))
+    s_ramp = s_curve[-1]
+    half = np.minimum(n / 2, s_ramp)
+    return 2 * np.interp(half, s_curve, t_curve) + np.maximum(n - 2 * s_ramp, 0.0) / profile.max_velocity
+
+
+def stopping_distance(profile: MotionProfile, velocity: float) -> int:
+    """Steps needed to slow from velocity down to start_velocity."""
+    s_curve, v_curve = _accel_curve(profile)
+    return int(np.ceil(np.interp(velocity, v_curve, s_curve)))
+
+
+@lru_cache(maxsize=64)
+def brake_table(profile: MotionProfile, velocity: float) -> np.ndarray:
+    """Per-step delays (us) to stop from velocity as fast as the profile
+    allows; stopping_distance(profile, velocity) entries long."""
+    n = stopping_distance(profile, velocity)
+    s_curve, v_curve = _accel_curve(profile)
+    pos = np.arange(n) + 0.5
+    table = 1e6 / np.interp(n - pos, s_curve, v_curve, right=profile.max_velocity)
+    table.setflags(write=False)
+    return table
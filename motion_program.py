@@ -0,0 +1,362 @@
+# motion_program.py
+#
+# Motion programs: a plain-text move sequence compiled ahead of time
+# into a step timeline.
+#
+# A hand-written sequence (goto, join, sleep, goto...) plans every move
+# when it runs.  A program is compiled once into arrays of
+# (time, shift word) events, which are cached on disk under a hash of
+# the program and everything it was compiled against.  Running it only
+# streams those events to the shifter, on absolute deadlines.
+#
+# Format, one statement per line, '#' starts a comment:
+#
+#     speed <motor|*> <steps/s>        constant step rate
+#     accel <motor|*> <steps/s^2>      ramp with this acceleration (0 = off)
+#     mode  <motor|*> half|full|wave   drive mode
+#     goto  <motor> <deg>              absolute, shortest way (like goAngle)
+#     move  <motor> <deg>              relative
+#     dwell <s>                        pause
+#     parallel ... end                 moves inside start together
+#
+# Each statement outside a parallel block starts once everything
+# before it has finished.  Speed, acceleration and mode default to the
+# motor's own delay, profile and drive_mode.  Degrees are stepper
+# degrees, unless compiled with gear ratios (TurretMotors.run_program
+# uses turret degrees).
+#
+# Example (the Lab8_4 demo):
+#
+#     DEMO = '''
+#     parallel
+#         goto m1 90
+#         goto m2 -90
+#     end
+#     parallel
+#         goto m1 -45
+#         goto m2 45
+#     end
+#     goto m1 -135
+#     goto m1 135
+#     goto m1 0
+#     '''
+#     run_program(DEMO, {'m1': m1, 'm2': m2})
+
+import hashlib
+import json
+import os
+from typing import NamedTuple
+import numpy as np
+from Lab8_4 import DRIVE_MODES
+from motion_profiles import MotionProfile, delay_table
+from step_scheduler import MERGE_WINDOW
+
+CACHE_DIR = os.path.expanduser("~/.cache/turret_programs")
+FORMAT_VERSION = 1
+
+
+class Timeline(NamedTuple):
+    """A compiled program: one entry per shift."""
+    names: tuple          # motor names, the column order below
+    times: np.ndarray     # s from the start of the program
+    words: np.ndarray     # bits (within mask) to latch at that time
+    mask: int             # outputs the program drives
+    positions: np.ndarray # (shifts, motors) half-steps moved since the start
+    phases: np.ndarray    # (shifts, motors) coil phase after the shift
+    duration: float       # s until the program is over (incl. trailing dwells)
+
+
+# ---------- parsing ----------
+
+def _parse(text: str, names) -> list:
+    """Statements as (line number, op, args), parallel blocks as
+    (line number, 'parallel', [statements])."""
+    out = []
+    block = None
+    for n, raw in enumerate(text.splitlines(), 1):
+        words = raw.split('#', 1)[0].split()
+        if not words:
+            continue
+        op, args = words[0].lower(), words[1:]
+        if op == 'parallel':
+            if block is not None or args:
+                raise ValueError(f"line {n}: parallel blocks take no arguments and do not nest")
+            block = []
+            out.append((n, 'parallel', block))
+            continue
+        if op == 'end':
+            if block is None:
+                raise ValueError(f"line {n}: 'end' without 'parallel'")
+            block = None
+            continue
+        expected = {'speed': 2, 'accel': 2, 'mode': 2, 'goto': 2, 'move': 2, 'dwell': 1}
+        if op not in expected:
+            raise ValueError(f"line {n}: unknown statement {op!r}")
+        if len(args) != expected[op]:
+            raise ValueError(f"line {n}: {op} takes {expected[op]} argument(s)")
+        if op == 'dwell':
+            args = [_number(n, args[0])]
+            if block is not None:
+                raise ValueError(f"line {n}: dwell inside a parallel block")
+        else:
+            motor, value = args
+            if motor not in names and not (motor == '*' and op in ('speed', 'accel', 'mode')):
+                raise ValueError(f"line {n}: unknown motor {motor!r}")
+            if op == 'mode':
+                if value not in DRIVE_MODES:
+                    raise ValueError(f"line {n}: unknown drive mode {value!r}")
+            else:
+                value = _number(n, value)
+            args = [motor, value]
+        (block if block is not None else out).append((n, op, args))
+    if block is not None:
+        raise ValueError("parallel block is missing its 'end'")
+    return out
+
+
+def _number(line: int, text: str) -> float:
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"line {line}: {text!r} is not a number") from None
+
+
+# ---------- compiling ----------
+
+class _Axis:
+    """Compile-time state of one motor."""
+
+    def __init__(self, stepper, ratio: float):
+        self.stepper = stepper
+        self.ratio = ratio
+        self.pos = stepper.position
+        self.start = self.pos
+        self.phase = stepper.step_state
+        self.profile = stepper.profile         # MotionProfile or None
+        self.delay = stepper.delay            # us per shift without a profile
+        self.mode = stepper.drive_mode
+        self.cursor = 0.0                      # time this motor is free again
+        self.events = []                       # (time, phase, pos)
+
+    def move(self, half_steps: int, start: float) -> None:
+        dir_sign = 1 if half_steps > 0 else -1
+        left = abs(half_steps)
+        if left == 0:
+            return
+        drive = self.stepper.drive_tables[self.mode][dir_sign > 0]
+        stride = DRIVE_MODES[self.mode][0]
+        shifts = -(-left // stride) + stride - 1
+        if self.profile:
+            delays = delay_table(self.profile, shifts).tolist()
+        else:
+            delays = [self.delay] * shifts
+        t = max(start, self.cursor)
+        k = 0
+        while left > 0:
+            phase, moved = drive[self.phase]
+            if moved > left:
+                # last half-step of a full/wave move: land exactly
+                phase, moved = (self.phase + dir_sign) % 8, 1
+            self.phase = phase
+            self.pos += dir_sign * moved
+            left -= moved
+            self.events.append((t, phase, self.pos - self.start))
+            t += delays[k] / 1e6
+            k += 1
+        self.cursor = t
+
+    def set_speed(self, steps_per_s: float) -> None:
+        if self.profile:
+            self.profile = self.profile._replace(max_velocity=steps_per_s)
+        self.delay = 1e6 / steps_per_s
+
+    def set_accel(self, accel: float) -> None:
+        if accel <= 0:
+            self.profile = None
+        elif self.profile:
+            self.profile = self.profile._replace(acceleration=accel)
+        else:
+            self.profile = MotionProfile(1e6 / self.delay, accel)
+
+    def shortest(self, deg: float) -> int:
+        """Half-steps to stepper angle deg, the shortest way round."""
+        spd = self.stepper.steps_per_degree
+        current = (self.pos % self.stepper.steps_per_rev) / spd
+        delta = (deg % 360.0) - current
+        if delta > 180.0:
+            delta -= 360.0
+        elif delta < -180.0:
+            delta += 360.0
+        return int(delta * spd)
+
+
+def compile_program(text: str, motors: dict, ratios: dict | None = None) -> Timeline:
+    """
+    Compile program text for motors {name: Stepper} (all on the same
+    shifter), starting from where they are now.  ratios {name: stepper
+    deg per program deg} scales angles per motor (default 1).
+    """
+    names = tuple(motors)
+    stmts = _parse(text, names)
+    axes = {name: _Axis(m, (ratios or {}).get(name, 1.0)) for name, m in motors.items()}
+    now = 0.0
+
+    def run(stmt, start):
+        n, op, args = stmt
+        if op in ('speed', 'accel', 'mode'):
+            motor, value = args
+            for axis in (axes.values() if motor == '*' else [axes[motor]]):
+                if op == 'speed':
+                    if value <= 0:
+                        raise ValueError(f"line {n}: speed must be positive")
+                    axis.set_speed(value)
+                elif op == 'accel':
+                    axis.set_accel(value)
+                else:
+                    axis.mode = value
+            return
+        axis = axes[args[0]]
+        deg = args[1] * axis.ratio
+        if op == 'goto':
+            axis.move(axis.shortest(deg), start)
+        else:
+            axis.move(int(deg * axis.stepper.steps_per_degree), start)
+
+    for stmt in stmts:
+        if stmt[1] == 'dwell':
+            now = max([now] + [a.cursor for a in axes.values()]) + stmt[2][0]
+            continue
+        now = max([now] + [a.cursor for a in axes.values()])
+        for inner in (stmt[2] if stmt[1] == 'parallel' else [stmt]):
+            run(inner, now)
+    duration = max([now] + [a.cursor for a in axes.values()])
+    return _build(names, axes, duration)
+
+
+def _build(names, axes: dict, duration: float) -> Timeline:
+    """Merge every motor's steps into shifts, like the scheduler does."""
+    frame = axes[names[0]].stepper.s.frame
+    t, motor, phase, pos = [], [], [], []
+    for j, name in enumerate(names):
+        for ev in axes[name].events:
+            t.append(ev[0])
+            motor.append(j)
+            phase.append(ev[1])
+            pos.append(ev[2])
+    order = np.argsort(np.array(t), kind='stable')
+    t = np.array(t, dtype=float)[order]
+    motor = np.array(motor, dtype=np.int64)[order]
+    phase = np.array(phase, dtype=np.int8)[order]
+    pos = np.array(pos, dtype=np.int64)[order]
+
+    # Steps due within MERGE_WINDOW of the first one in a tick share
+    # its shift; keep the state after the last step of each tick.
+    last = []
+    tick_times = []
+    tick_start = None
+    for k, tk in enumerate(t):
+        if tick_start is None or tk > tick_start + MERGE_WINDOW:
+            if tick_start is not None:
+                last.append(k - 1)
+            tick_start = tk
+            tick_times.append(tk)
+    if tick_start is not None:
+        last.append(len(t) - 1)
+    last = np.array(last, dtype=np.int64)
+
+    m = len(names)
+    positions = np.zeros((len(last), m), dtype=np.int64)
+    phases = np.zeros((len(last), m), dtype=np.int8)
+    words = np.zeros(len(last), dtype=np.uint64)
+    mask = 0
+    index = np.arange(len(t))
+    for j, name in enumerate(names):
+        stepper = axes[name].stepper
+        bit = stepper.shifter_bit_start
+        mask |= 0b1111 << bit
+        # latest step of motor j at or before each event (-1: none yet)
+        latest = np.maximum.accumulate(np.where(motor == j, index, -1))[last]
+        seq = np.array(stepper.seq, dtype=np.uint64)
+        nibble = np.where(latest >= 0, seq[phase[latest]], (frame >> bit) & 0b1111)
+        words |= nibble.astype(np.uint64) << np.uint64(bit)
+        positions[:, j] = np.where(latest >= 0, pos[latest], 0)
+        phases[:, j] = np.where(latest >= 0, phase[latest], stepper.step_state)
+    return Timeline(names, np.array(tick_times, dtype=float), words, mask,
+                    positions, phases, float(duration))
+
+
+# ---------- disk cache ----------
+
+def _cache_key(text: str, motors: dict, ratios: dict | None) -> str:
+    spec = [FORMAT_VERSION, text]
+    for name, m in motors.items():
+        spec.append([name, m.shifter_bit_start, m.position, m.step_state, m.delay,
+                     list(m.profile) if m.profile else None, m.drive_mode,
+                     m.steps_per_rev, (ratios or {}).get(name, 1.0),
+                     (m.s.frame >> m.shifter_bit_start) & 0b1111])
+    return hashlib.sha256(json.dumps(spec).encode()).hexdigest()[:32]
+
+
+def load_program(text: str, motors: dict, ratios: dict | None = None,
+                 cache_dir: str | None = CACHE_DIR) -> Timeline:
+    """compile_program(), cached on disk by a hash of the program and
+    of the motors' positions and settings.  cache_dir=None disables
+    the cache."""
+    if cache_dir is None:
+        return compile_program(text, motors, ratios)
+    path = os.path.join(cache_dir, _cache_key(text, motors, ratios) + ".npz")
+    try:
+        with np.load(path) as f:
+            return Timeline(tuple(motors), f['times'], f['words'], int(f['mask']),
+                            f['positions'], f['phases'], float(f['duration']))
+    except (OSError, KeyError, ValueError):
+        pass
+    timeline = compile_program(text, motors, ratios)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, times=timeline.times, words=timeline.words, mask=timeline.mask,
+             positions=timeline.positions, phases=timeline.phases,
+             duration=timeline.duration)
+    os.replace(tmp, path)
+    return timeline
+
+
+# ---------- running ----------
+
+def run_program(program, motors: dict, ratios: dict | None = None,
+                cache_dir: str | None = CACHE_DIR, sync: bool = True):
+    """
+    Run a program (text, or a Timeline compiled for these motors from
+    their current positions) on motors {name: Stepper}.  Waits for the
+    motors to be idle first.  While it runs, the shifter's scheduler
+    does nothing else: other motors on the same shifter pause.
+
+    If sync=False, returns a MoveHandle (on the first motor) for the
+    whole program.
+    """
+    steppers = list(motors.values())
+    if not steppers:
+        raise ValueError("no motors")
+    scheduler = steppers[0]._scheduler
+    if any(m._scheduler is not scheduler for m in steppers):
+        raise ValueError("all motors of a program must be on the same shifter")
+    for m in steppers:
+        m.wait_idle()
+    timeline = program
+    if isinstance(program, str):
+        timeline = load_program(program, motors, ratios, cache_dir)
+    payload = (
+        timeline.times.tolist(),
+        timeline.words.tolist(),
+        timeline.mask,
+        [motors[name]._slot for name in timeline.names],
+        timeline.positions.tolist(),
+        timeline.phases.tolist(),
+        timeline.duration,
+    )
+    cmd, handle = steppers[0]._command('timeline', payload)
+    scheduler.submit(cmd)
+    if sync:
+        handle.join()
+        return None
+    return handle
@@ -0,0 +1,207 @@
+# motion_trace.py
+#
+# Record and replay of motion sessions as compact binary traces.
+#
+# A TraceRecorder attached to a shifter's scheduler appends two kinds
+# of record to a file: every move command as it is submitted (which
+# motor, goto/rotate/..., the value, when) and every shift word the
+# scheduler latches (when, which word).  Records are fixed-size structs
+# behind a one-byte type, so a shift costs 17 bytes.
+#
+#     file    = MAGIC, then records
+#     SESSION = type 0, t=0, wall-clock start (time.time())
+#     COMMAND = type 1, t, slot, move id, kind, mode, value, value2, scale
+#     SHIFT   = type 2, t, word
+#
+# t is seconds since the session started (perf_counter, which every
+# process shares).  The file is only ever appended to: recording into an
+# existing trace starts a new session.  The scheduler worker buffers
+# its shift records and writes them out whenever it goes idle, so the
+# step path does no I/O.
+#
+# replay() plays a session's shift words into any Shifter (simulated
+# or real) at the original speed, scaled, or as fast as possible.  Two
+# replays of a trace into the simulator shift exactly the same words,
+# so traces double as regression fixtures for the shift path.
+#
+# Example:
+#
+#     turret.start_recording("run.trace")
+#     turret.goto(45, 10)
+#     turret.stop_recording()
+#
+#     session = read_trace("run.trace")[-1]
+#     print(session.commands[0])                # CommandRecord(...)
+#     replay(session, Shifter(data=16, clock=20, latch=21))
+
+import os
+import struct
+import time
+from typing import NamedTuple
+import numpy as np
+from step_timer import StepTimer
+
+MAGIC = b'MTRACE1\n'
+SESSION, COMMAND, SHIFT = 0, 1, 2
+
+_HEAD = struct.Struct('<Bd')
+_RECORDS = {
+    SESSION: struct.Struct('<Bdd'),
+    COMMAND: struct.Struct('<BdHqBBddd'),
+    SHIFT: struct.Struct('<BdQ'),
+}
+KINDS = ('rotate', 'goto', 'steps', 'segment', 'retarget', 'zero', 'timeline',
+         'cancel', 'flush')
+MODES = ('half', 'full', 'wave')
+_NO_MODE = 255
+
+FLUSH_BYTES = 64 * 1024  # worker writes its buffer out at least this often
+
+
+class CommandRecord(NamedTuple):
+    t: float              # s since the session started
+    slot: int             # motor slot on its scheduler
+    move_id: int
+    kind: str
+    mode: str | None
+    value: float          # degrees, half-step target, ... (NaN if not a number)
+    value2: float         # segment duration, else NaN
+    scale: float
+
+
+class Session(NamedTuple):
+    wall_time: float      # time.time() when recording started
+    commands: list        # CommandRecords
+    shifts: np.ndarray    # structured: t (s), word
+
+
+class ReplayReport(NamedTuple):
+    shifts: int
+    duration: float       # s the replay took
+    max_late: float       # worst lateness against the (scaled) trace timing, s
+
+
+class TraceRecorder:
+
+    def __init__(self, path: str):
+        """Open path for appending (creating it if needed) and start a
+        new session."""
+        self.path = path
+        self._pid = None
+        self._fd = None
+        self._buffer = bytearray()
+        self._t0 = time.perf_counter()
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self._write(MAGIC)
+        self._write(_RECORDS[SESSION].pack(SESSION, 0.0, time.time()))
+
+    def _write(self, data: bytes) -> None:
+        # Each process (the caller, the scheduler worker) opens its own
+        # O_APPEND descriptor, so their writes never overwrite each other.
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        os.write(self._fd, data)
+
+    def command(self, cmd: tuple) -> None:
+        """Record a scheduler command (slot, move_id, kind, value,
+        profile, mode, scale, delay) as it is submitted."""
+        slot, move_id, kind, value, _, mode, scale, _ = cmd
+        value2 = float('nan')
+        if kind == 'segment':
+            value, value2 = value
+        elif not isinstance(value, (int, float)):
+            value = float('nan')  # e.g. a timeline's arrays: its shifts say it all
+        self._write(_RECORDS[COMMAND].pack(
+            COMMAND, time.perf_counter() - self._t0, slot, move_id, KINDS.index(kind),
+            MODES.index(mode) if mode in MODES else _NO_MODE, value, value2, scale))
+
+    def shift(self, t: float, word: int) -> None:
+        """Record a latched word (perf_counter time t).  Buffered: call
+        flush() when idle."""
+        self._buffer += _RECORDS[SHIFT].pack(SHIFT, t - self._t0, word)
+        if len(self._buffer) >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self._write(data)
+
+    def close(self) -> None:
+        self.flush()
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+        self._pid = None
+
+
+def read_trace(path: str) -> list[Session]:
+    """Every session in a trace file, oldest first."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a motion trace")
+    sessions = []
+    commands, shifts = None, None
+    offset = len(MAGIC)
+    while offset + _HEAD.size <= len(data):
+        kind = data[offset]
+        record = _RECORDS.get(kind)
+        if record is None:
+            raise ValueError(f"{path}: bad record type {kind} at byte {offset}")
+        if offset + record.size > len(data):
+            break  # cut short by a crash mid-write
+        fields = record.unpack_from(data, offset)
+        offset += record.size
+        if kind == SESSION:
+            commands, shifts = [], []
+            sessions.append((fields[2], commands, shifts))
+        elif commands is None:
+            raise ValueError(f"{path}: record before the first session")
+        elif kind == COMMAND:
+            _, t, slot, move_id, k, mode, value, value2, scale = fields
+            commands.append(CommandRecord(t, slot, move_id, KINDS[k],
+                                          None if mode == _NO_MODE else MODES[mode],
+                                          value, value2, scale))
+        else:
+            shifts.append(fields[1:])
+    out = []
+    for wall_time, commands, shifts in sessions:
+        commands.sort(key=lambda c: c.t)
+        # shift records arrive in worker-sized batches: put them in order
+        array = np.array(shifts, dtype=[('t', 'f8'), ('word', 'u8')])
+        out.append(Session(wall_time, commands, np.sort(array, order='t', kind='stable')))
+    return out
+
+
+def replay(trace, shifter, speed: float | None = 1.0, session: int = -1) -> ReplayReport:
+    """
+    Latch a recorded session's shift words on shifter.
+
+    trace:   a Session, or the path of a trace file (session picks which
+             one, default the last).
+    speed:   1.0 = original timing, 2.0 = twice as fast, None = as fast
+             as the shifter goes.
+    The shifter must not be in use by a step scheduler meanwhile.
+    """
+    if not isinstance(trace, Session):
+        trace = read_trace(trace)[session]
+    times = trace.shifts['t'].tolist()
+    words = trace.shifts['word'].tolist()
+    timer = StepTimer()
+    clock = time.perf_counter
+    max_late = 0.0
+    start = clock()
+    if speed is None:
+        for word in words:
+            shifter.write(word)
+    else:
+        t_first = times[0] if times else 0.0
+        for t, word in zip(times, words):
+            late = timer.wait_until(start + (t - t_first) / speed)
+            if late > max_late:
+                max_late = late
+            shifter.write(word)
+    return ReplayReport(len(words), clock() - start, max_late)
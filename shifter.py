@@ -1,48 +1,171 @@
 # Shift register class
 
-from RPi import GPIO
+import multiprocessing
+from gpio_backend import GPIO
 from time import sleep
 
-GPIO.setmode(GPIO.BCM)
-
 class Shifter():
 
-    def __init__(self, data, clock, latch):
+    # num_bits is the width of the whole chain: 8 per 74HC595, so
+    # num_bits=16 for two registers with QH' of the first wired to SER
+    # of the second.
+    def __init__(self, data, clock, latch, num_bits=8):
         self.dataPin = data
         self.latchPin = latch
         self.clockPin = clock
+        self._init_frame(num_bits)
+        # The pins are set up by open() (or the first shift), not here,
+        # so creating or importing a Shifter never touches the hardware.
+
+    def _init_frame(self, num_bits):
+        if num_bits <= 0:
+            raise ValueError("num_bits must be positive")
+        self.num_bits = num_bits  # width of one frame (the whole chain)
+        # Frame-buffer state: [0] word being built, [1] last latched word
+        # (-1 = unknown), [2] current data pin level (-1 = unknown).
+        # Kept in shared memory so Stepper processes forked off this
+        # Shifter agree on what the register and data pin really hold.
+        self._state = multiprocessing.RawArray('q', [0, -1, -1])
+        self._next_bit = 0  # outputs below this are handed out (allocate)
+        self.is_open = False
+
+    # ---------- hardware setup ----------
+
+    def open(self):
+        """Set up the pins.  Done automatically by the first shift;
+        returns self, so `with Shifter(...) as s:` works too."""
+        if not self.is_open:
+            self._open()
+            self.is_open = True
+        return self
+
+    def _open(self):
+        # Resolved once here rather than through the GPIO proxy on
+        # every call: the shift loop makes ~3 of these per bit.
+        self._output = GPIO.output
+        GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.dataPin, GPIO.OUT)
         GPIO.setup(self.latchPin, GPIO.OUT)
         GPIO.setup(self.clockPin, GPIO.OUT)
 
+    def close(self):
+        """Clear the outputs and release the pins.  The next shift (or
+        open()) sets them up again."""
+        if self.is_open:
+            self.clear()
+            self._close()
+            self.is_open = False
+
+    def _close(self):
+        GPIO.cleanup((self.dataPin, self.latchPin, self.clockPin))
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
     def ping(self, p):  # ping the clock or latch pin
-        GPIO.output(p,1)
+        output = self._output
+        output(p,1)
         sleep(0)
-        GPIO.output(p,0)
+        output(p,0)
+
+    # Clock out num_bits of a word, bit 0 first, then latch.
+    # The data pin is only written when the next bit differs from
+    # what it already holds.
+    def _shift_bits(self, dataword, num_bits):
+        state = self._state
+        output = self._output
+        data, clock = self.dataPin, self.clockPin
+        level = state[2]
+        for i in range(num_bits):
+            bit = (dataword >> i) & 1
+            if bit != level:
+                output(data, bit)
+                level = bit
+            output(clock, 1)  # same pulse as ping(), without the call
+            sleep(0)
+            output(clock, 0)
+        state[2] = level
+        self.ping(self.latchPin)
 
     # Shift all bits in an arbitrary-length word, allowing
     # multiple 8-bit shift registers to be chained (with overflow
     # of SR_n tied to input of SR_n+1):
     def shiftWord(self, dataword, num_bits):
-        for i in range((num_bits+1) % 8):  # Load bits short of a byte with 0
-            # self.dataPin.value(0)  # MicroPython for ESP32
-            GPIO.output(self.dataPin, 0) 
-            self.ping(self.clockPin)
-        for i in range(num_bits):          # Send the word
-            # self.dataPin.value(dataword & (1<<i))  # MicroPython for ESP32
-            GPIO.output(self.dataPin, dataword & (1<<i))
-            self.ping(self.clockPin)
-        self.ping(self.latchPin)
+        if not self.is_open:
+            self.open()
+        # Load bits short of a whole byte with 0 first
+        pad = (8 - num_bits % 8) % 8
+        dataword &= (1 << num_bits) - 1
+        self._shift_bits(dataword << pad, num_bits + pad)
+        self._state[1] = dataword
 
     # Shift all bits in a single byte:
     def shiftByte(self, databyte):
         self.shiftWord(databyte, 8)
 
+    # ---------- output allocation ----------
+
+    def allocate(self, width):
+        """Reserve the next `width` outputs of the chain (e.g. 4 for a
+        stepper's coils) and return the first bit number."""
+        start = self._next_bit
+        if start + width > self.num_bits:
+            raise ValueError(
+                f"shifter has {self.num_bits - start} of {self.num_bits} outputs free, "
+                f"{width} needed (chain another 74HC595 and raise num_bits)")
+        self._next_bit = start + width
+        return start
+
+    # ---------- frame-buffer API ----------
+    #
+    # write()/clear()/set_bits() only touch the pins when the frame
+    # actually changes: an unchanged frame costs no GPIO calls at all.
+
+    @property
+    def frame(self):
+        """Word currently held in the frame buffer (not necessarily latched)."""
+        return self._state[0]
+
+    def set_bits(self, mask, value):
+        """Replace the bits selected by mask in the frame buffer (no shift)."""
+        state = self._state
+        state[0] = (state[0] & ~mask) | (value & mask)
+
+    def flush(self):
+        """Latch the frame buffer if it differs from the last latched word.
+        Returns True if a transfer happened."""
+        word = self._state[0]
+        if word == self._state[1]:
+            return False
+        self.shiftWord(word, self.num_bits)
+        return True
+
+    def write(self, word):
+        """Set the whole frame and latch it (skipped if unchanged)."""
+        self._state[0] = word & ((1 << self.num_bits) - 1)
+        return self.flush()
+
+    def clear(self):
+        """Turn every output off."""
+        return self.write(0)
+
+    def cleanup(self):
+        """Clear the outputs and release the three pins (same as close())."""
+        self.close()
+
 
 # Example:
 #
 # from time import sleep
 # s = Shifter(data=16,clock=20,latch=21)   # convenient Pi pins
 # for i in range(256):
-#     s.shiftByte(i)
+#     s.write(i)         # or s.shiftByte(i) to always shift
 #     sleep(0.1)
+#
+# Two chained registers, four steppers on one chain:
+#
+# s = Shifter(data=16,clock=20,latch=21,num_bits=16)
+# motors = [Stepper(s) for _ in range(4)]   # bits 0-3, 4-7, 8-11, 12-15
@@ -5,21 +5,31 @@ ENME441 - Lab 7 - Sockets and Network Communication
 Problem 1
 '''
 
-import socket
-import RPi.GPIO as GPIO
+from gpio_backend import GPIO
+from http_core import HttpServer
 
-# setup GPIO pins and PWM
 pins = [5, 6, 13]
-GPIO.setmode(GPIO.BCM)
 pwms = []
 levels = [0, 0, 0]  # store brightness for each LED
 
-for p in pins:
-    GPIO.setup(p, GPIO.OUT)
-    pwm = GPIO.PWM(p, 500)  # 500 Hz PWM
-    pwm.start(0)
-    pwms.append(pwm)
-    
+# setup GPIO pins and PWM (called by main(), so importing this file
+# doesn't touch the pins)
+def setup_leds():
+    if pwms:
+        return
+    GPIO.setmode(GPIO.BCM)
+    for p in pins:
+        GPIO.setup(p, GPIO.OUT)
+        pwm = GPIO.PWM(p, 500)  # 500 Hz PWM
+        pwm.start(0)
+        pwms.append(pwm)
+
+# stop PWM and release the pins
+def release_leds():
+    for p in pwms: p.stop()
+    pwms.clear()
+    GPIO.cleanup()
+
 # create HTML page for browser
 def htmlPage(selected = 0):
     html = f"""<!doctype html>
@@ -44,8 +54,7 @@ def ok(body):
     header = (
         "HTTP/1.1 200 OK\r\n"
         f"Content-Length: {len(body)}\r\n"
-        "Content-Type: text/html\r\n"
-        "Connection: close\r\n\r\n"
+        "Content-Type: text/html\r\n\r\n"
     )
     return header.encode() + body
 
@@ -67,31 +76,32 @@ def set_led(i, value):
         levels[i] = value
         pwms[i].ChangeDutyCycle(value)
 
-# start basic socket web server
-s = socket.socket()
-s.bind(("",8080))
-s.listen(1)
-print("Server ready on http://bkpi.local:8080")
+# answer one request (the whole request text, body included)
+def handle_request(req):
+    method = req.split(" ")[0]  # check GET or POST
 
-try:
-    while True:
-        c,a = s.accept()  # wait for browser connection
-        req = c.recv(1024).decode()
-        method = req.split(" ")[0]  # check GET or POST
+    if method == "POST":
+        d = parse_post(req)  # extract form data
+        led = d.get("led","0")
+        level = d.get("level","0")
+        set_led(led, level)  # update PWM
+        return ok(htmlPage(int(led)))  # send updated page
+    return ok(htmlPage())  # show default page
 
-        if method == "POST":
-            d = parse_post(req)  # extract form data
-            led = d.get("led","0")
-            level = d.get("level","0")
-            set_led(led, level)  # update PWM
-            c.sendall(ok(htmlPage(int(led))))  # send updated page
-        else:
-            c.sendall(ok(htmlPage()))  # show default page
-        c.close()
+def main():
+    setup_leds()
 
-except KeyboardInterrupt:
-    pass
-finally:
-    for p in pwms: p.stop()
-    GPIO.cleanup()
-    s.close()
+    # start the web server (keep-alive, many browsers at once: see http_core.py)
+    server = HttpServer(handle_request, port=8080)
+    print("Server ready on http://bkpi.local:8080")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        release_leds()
+        server.close()
+
+if __name__ == "__main__":
+    main()
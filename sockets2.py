@@ -5,28 +5,37 @@ ENME441 - Lab 7 - Sockets and Network Communication
 Problem 2
 '''
 
-import socket
-import RPi.GPIO as GPIO
+from gpio_backend import GPIO
+from http_core import HttpServer
 
-# setup GPIO pins and PWM
 pins = [5, 6, 13]  # same wiring as part 1
-GPIO.setmode(GPIO.BCM)
 pwms = []
 levels = [0, 0, 0]  # brightness for each LED
 
-for p in pins:
-    GPIO.setup(p, GPIO.OUT)
-    pwm = GPIO.PWM(p, 500)  # 500 Hz
-    pwm.start(0)
-    pwms.append(pwm)
+# setup GPIO pins and PWM (called by main(), so importing this file
+# doesn't touch the pins)
+def setup_leds():
+    if pwms:
+        return
+    GPIO.setmode(GPIO.BCM)
+    for p in pins:
+        GPIO.setup(p, GPIO.OUT)
+        pwm = GPIO.PWM(p, 500)  # 500 Hz
+        pwm.start(0)
+        pwms.append(pwm)
+
+# stop PWM and release the pins
+def release_leds():
+    for p in pwms: p.stop()
+    pwms.clear()
+    GPIO.cleanup()
 
 # helper to send normal HTTP 200 with body
 def http_ok(body, ctype="text/html"):
     header = (
         "HTTP/1.1 200 OK\r\n"
         f"Content-Length: {len(body)}\r\n"
-        f"Content-Type: {ctype}\r\n"
-        "Connection: close\r\n\r\n"
+        f"Content-Type: {ctype}\r\n\r\n"
     )
     return header.encode() + body
 
@@ -48,10 +57,17 @@ def set_led(i, value):
         levels[i] = value
         pwms[i].ChangeDutyCycle(value)
 
+# WebSocket message from the page: pairs of bytes [led, level], e.g.
+# b"\x01\x4d" = LED 1 to 77 (a frame may carry several pairs)
+def handle_ws(message):
+    for k in range(0, len(message) - 1, 2):
+        set_led(message[k], message[k + 1])
+
 # build the HTML+JS page with 3 sliders
 def build_page():
     # inline JS:
-    #  - when a slider moves, send POST to /set with led index + value
+    #  - when a slider moves, send [led index, value] over the WebSocket
+    #    at /ws (2 bytes), or POST to /set if it isn't open
     #  - update the number next to that slider
     page = f"""<!doctype html>
 <html>
@@ -77,12 +93,27 @@ def build_page():
     </div>
 
     <script>
+      // WebSocket to the Pi if the browser has one; reconnect if it drops
+      let ws = null;
+      function connect() {{
+        if (!("WebSocket" in window)) return;
+        ws = new WebSocket("ws://" + location.host + "/ws");
+        ws.onclose = function() {{ setTimeout(connect, 1000); }};
+      }}
+      connect();
+
       // send new brightness to the Pi
       function sendUpdate(ledIndex, levelValue) {{
         // update number on screen right away
         document.getElementById("val"+ledIndex).textContent = levelValue;
 
-        // build form body like led=1&level=77
+        // two bytes over the socket when it's open
+        if (ws && ws.readyState === WebSocket.OPEN) {{
+          ws.send(new Uint8Array([ledIndex, Number(levelValue)]));
+          return;
+        }}
+
+        // otherwise build form body like led=1&level=77
         let body = "led=" + ledIndex + "&level=" + levelValue;
 
         // send POST to /set without reloading page
@@ -114,6 +145,7 @@ def build_page():
 
 # minimal HTTP router:
 # GET  /      -> send page
+# GET  /ws    -> WebSocket upgrade (handled by http_core, see handle_ws)
 # POST /set   -> update LED brightness, return "OK"
 # anything else -> 404
 def handle_request(req_text):
@@ -141,28 +173,26 @@ def handle_request(req_text):
     header = (
         "HTTP/1.1 404 Not Found\r\n"
         f"Content-Length: {len(body)}\r\n"
-        "Content-Type: text/plain\r\n"
-        "Connection: close\r\n\r\n"
+        "Content-Type: text/plain\r\n\r\n"
     )
     return header.encode() + body
 
-# open socket and serve requests
-s = socket.socket()
-s.bind(("",8080))
-s.listen(1)
-print("Server ready on http://bkpi.local:8080  (Problem 2)")
-
-try:
-    while True:
-        c,a = s.accept()
-        req = c.recv(2048).decode()  # read browser request (a little bigger buffer now)
-        resp = handle_request(req)   # decide what to do
-        c.sendall(resp)              # send HTTP response
-        c.close()
-
-except KeyboardInterrupt:
-    pass
-finally:
-    for p in pwms: p.stop()
-    GPIO.cleanup()
-    s.close()
+def main():
+    setup_leds()
+
+    # serve requests: connections stay open between slider updates and
+    # many browsers can be connected at once (see http_core.py); slider
+    # updates arrive on /ws when the browser supports WebSockets
+    server = HttpServer(handle_request, port=8080, websockets={"/ws": handle_ws})
+    print("Server ready on http://bkpi.local:8080  (Problem 2)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        release_leds()
+        server.close()
+
+if __name__ == "__main__":
+    main()
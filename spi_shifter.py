@@ -0,0 +1,147 @@
+# spi_shifter.py
+#
+# Hardware-SPI transport for the 74HC595 shift register.
+#
+# Wiring (SPI0): MOSI (GPIO10) -> SER, SCLK (GPIO11) -> SRCLK, and any
+# GPIO -> RCLK (latch).  A whole word goes out in a single spidev xfer
+# call and the only Python-level GPIO work is the latch pulse, instead
+# of ~3 GPIO.output calls per bit when bit-banging.
+#
+# SpiShifter has the same interface as Shifter (shiftByte, shiftWord,
+# write, clear, set_bits, flush).  If spidev is missing or the device
+# node cannot be opened it falls back to bit-banging on the data/clock
+# pins, so code written against it runs anywhere.
+#
+# Example:
+#
+#     s = SpiShifter(latch=21)               # /dev/spidev0.0
+#     s.shiftByte(0xA5)
+#     s = SpiShifter(latch=21, spi=LoopbackSPI())   # no device needed
+
+from gpio_backend import GPIO
+from shifter import Shifter
+
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
+SPI0_MOSI = 10
+SPI0_SCLK = 11
+
+# Bit-reversed bytes: SPI clocks each byte out MSB first, the bit-banged
+# Shifter clocks bit 0 first, so every byte is mirrored before sending.
+_REVERSED = bytes(int(f"{b:08b}"[::-1], 2) for b in range(256))
+
+
+class LoopbackSPI:
+    """
+    Stand-in for spidev.SpiDev with MISO tied to MOSI.
+
+    Every transfer is echoed back and kept in `transfers`, so the SPI
+    transport can be tested and benchmarked without a device node.
+    """
+
+    def __init__(self):
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.bits_per_word = 8
+        self.transfers = []
+        self.is_open = False
+
+    def open(self, bus: int, device: int) -> None:
+        self.is_open = True
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def xfer2(self, data):
+        data = list(data)
+        self.transfers.append(bytes(data))
+        return data
+
+    xfer = xfer2
+
+    def writebytes(self, data) -> None:
+        self.xfer2(data)
+
+    def words(self, num_bits: int = 8):
+        """Decode the transfers back into the words that were shifted."""
+        pad = (8 - num_bits % 8) % 8
+        for frame in self.transfers:
+            raw = int.from_bytes(bytes(_REVERSED[b] for b in frame), 'little')
+            yield raw >> pad
+
+
+class SpiShifter(Shifter):
+
+    def __init__(self, latch, bus=0, device=0, speed_hz=4_000_000,
+                 data=SPI0_MOSI, clock=SPI0_SCLK, spi=None, num_bits=8):
+        """
+        latch:
+            GPIO pin wired to RCLK.
+        bus, device, speed_hz:
+            spidev device (/dev/spidev<bus>.<device>) and clock rate.
+        data, clock:
+            pins used if we have to fall back to bit-banging
+            (default: the SPI0 MOSI/SCLK pins themselves).
+        spi:
+            an already-constructed SpiDev-like object (e.g. LoopbackSPI).
+        num_bits:
+            width of the register chain (8 per 74HC595).
+        """
+        self.dataPin = data
+        self.latchPin = latch
+        self.clockPin = clock
+        self._init_frame(num_bits)
+        self._bus = bus
+        self._device = device
+        self._speed_hz = speed_hz
+        self._given_spi = spi
+        self._spi = None  # set by open()
+
+    def _open(self):
+        self._output = GPIO.output  # latch pulses (and the bit-bang fallback)
+        spi = self._given_spi
+        self._spi = spi if spi is not None else self._open_spi(self._bus, self._device)
+        if self._spi is not None:
+            self._spi.max_speed_hz = self._speed_hz
+            self._spi.mode = 0
+        else:
+            # No SPI: drive SER/SRCLK by hand like the plain Shifter.
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(self.dataPin, GPIO.OUT)
+            GPIO.setup(self.clockPin, GPIO.OUT)
+        GPIO.setup(self.latchPin, GPIO.OUT)
+
+    @staticmethod
+    def _open_spi(bus, device):
+        if spidev is None:
+            return None
+        spi = spidev.SpiDev()
+        try:
+            spi.open(bus, device)
+        except OSError:  # no /dev/spidevB.D (SPI disabled) or no permission
+            return None
+        return spi
+
+    @property
+    def uses_spi(self) -> bool:
+        self.open()
+        return self._spi is not None
+
+    def _shift_bits(self, dataword, num_bits):
+        if self._spi is None:
+            return Shifter._shift_bits(self, dataword, num_bits)
+        # num_bits is always a whole number of bytes here (shiftWord pads)
+        raw = dataword.to_bytes(num_bits // 8, 'little')
+        self._spi.xfer2([_REVERSED[b] for b in raw])
+        self.ping(self.latchPin)
+
+    def _close(self):
+        if self._spi is not None:
+            self._spi.close()
+            self._spi = None
+            GPIO.cleanup(self.latchPin)
+        else:
+            GPIO.cleanup((self.dataPin, self.latchPin, self.clockPin))
@@ -0,0 +1,540 @@
+# step_scheduler.py
+#
+# One step scheduler per Shifter.
+#
+# Every Stepper attached to a Shifter hands its moves to the Shifter's
+# scheduler.  A single worker process owns the shift register: on each
+# tick it advances every motor that has a move in progress, merges all
+# their coil patterns into one word and latches it with one write().
+# Two motors moving together therefore cost one shift per tick (not
+# two), and the step path takes no locks at all.
+#
+# Steppers get their scheduler automatically:
+#
+#     s = Shifter(data=16, latch=20, clock=21)
+#     m1 = Stepper(s); m2 = Stepper(s)     # both share s's scheduler
+#     m1.goAngle(90); m2.goAngle(-90)      # stepped in the same ticks
+
+import multiprocessing
+import sys
+import time
+import traceback
+from collections import deque
+from step_timer import MoveStats, StepTimer
+
+# motion_profiles (NumPy) is imported by the parent just before it forks
+# a worker, not at import time and not in the worker: a first profiled
+# move making the worker import NumPy would stall every motor on the
+# shifter for ~100 ms.  step_telemetry is imported when enabled, which
+# restarts the worker anyway.
+
+# Motors whose next step is due within this many seconds of each other
+# are stepped in the same tick, so they share one shift.
+MERGE_WINDOW = 100e-6
+
+# Long waits (dwells, slow segments) are slept in slices this long so
+# commands posted meanwhile are picked up within about this much time.
+COMMAND_POLL = 250e-6
+
+
+class StepScheduler:
+
+    def __init__(self, shifter):
+        self.shifter = shifter
+        self.motors = []
+        self.cond = multiprocessing.Condition()
+        self._queue = multiprocessing.Queue()
+        # Number of commands put on the queue.  The worker compares it
+        # with what it has read so it never polls the pipe on a tick.
+        self._posted = multiprocessing.RawValue('q', 0)
+        self.timer = StepTimer()
+        self.telemetry = None  # StepTelemetry while enabled
+        self.recorder = None   # motion_trace.TraceRecorder while recording
+        self._worker = None
+        self._stopping = False  # told to stop, may still be finishing moves
+
+    @classmethod
+    def for_shifter(cls, shifter) -> "StepScheduler":
+        """The scheduler that owns `shifter` (created on first use)."""
+        sched = getattr(shifter, '_scheduler', None)
+        if sched is None:
+            sched = cls(shifter)
+            shifter._scheduler = sched
+        return sched
+
+    def attach(self, stepper) -> int:
+        """Register a motor and return its slot number."""
+        if self.running():
+            # The worker only knows the motors it was forked with:
+            # let it finish what it is doing and start a new one later.
+            self.close()
+        self.motors.append(stepper)
+        return len(self.motors) - 1
+
+    def enable_telemetry(self, capacity: int = 65536):
+        """Record every step of every motor (see step_telemetry).  Takes
+        effect from the next move; returns the StepTelemetry recorder."""
+        from step_telemetry import StepTelemetry
+        if self.telemetry is None or self.telemetry.capacity != capacity:
+            if self.running():
+                self.close()  # the worker picks it up when it restarts
+            self.telemetry = StepTelemetry(capacity)
+        return self.telemetry
+
+    def disable_telemetry(self) -> None:
+        if self.telemetry is not None:
+            if self.running():
+                self.close()
+            self.telemetry = None
+
+    def start_recording(self, recorder) -> None:
+        """Log every command and latched word to a motion_trace
+        TraceRecorder, from the next move on."""
+        self.stop_recording()
+        if self.running():
+            self.close()  # the worker picks it up when it restarts
+        self.recorder = recorder
+
+    def stop_recording(self) -> None:
+        """Stop recording (after the queued moves have run) and close
+        the recorder."""
+        if self.recorder is None:
+            return
+        if self.running():
+            self.close()  # the worker flushes its shift records on exit
+        self.recorder.close()
+        self.recorder = None
+
+    def running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def submit(self, *cmds: tuple) -> None:
+        """
+        Queue move commands, each (slot, move_id, kind, value, profile,
+        mode, scale, delay).  Commands passed in one call reach the worker
+        together, so moves for idle motors start on the same tick.
+        kind 'cancel' / 'flush' (value = a move id) drop that move / every
+        move up to it instead.
+        """
+        if self._stopping or not self.running():
+            self._start_worker()
+        if self.recorder is not None:
+            for cmd in cmds:
+                self.recorder.command(cmd)
+        self._queue.put(cmds)
+        self._posted.value += 1
+
+    def _start_worker(self) -> None:
+        if self._worker is not None:
+            # A close() that timed out: that worker is still finishing its
+            # moves.  Two workers must never share the queue or the pins.
+            self._worker.join()
+            self._worker = None
+            self._stopping = False
+        import motion_profiles  # noqa: F401 - inherited by the worker
+        # set the pins up here, so the worker inherits an open shifter
+        self.shifter.open()
+        # The new worker has read nothing yet.  Left at the old count it
+        # would think commands were waiting and block on the empty queue,
+        # and the first move after a restart would never run.
+        self._posted.value = 0
+        self._worker = multiprocessing.Process(target=self._run, daemon=True)
+        self._worker.start()
+
+    def close(self, timeout: float | None = None) -> None:
+        """
+        Stop the worker once every queued move has finished.  If that
+        takes longer than timeout, the worker is left to finish in the
+        background (the next submit() waits for it).
+        """
+        if self._worker is None:
+            return
+        if not self._stopping and self._worker.is_alive():
+            self._queue.put(None)
+            self._posted.value += 1
+            self._stopping = True
+        self._worker.join(timeout)
+        if not self._worker.is_alive():
+            self._worker = None
+            self._stopping = False
+
+    # ---------- worker process ----------
+
+    def _wait(self, deadline: float, seen: int) -> float | None:
+        """timer.wait_until(deadline), except that it returns None early
+        if more than `seen` commands have been posted meanwhile."""
+        posted = self._posted
+        clock = time.perf_counter
+        slice_end = COMMAND_POLL + self.timer.spin
+        while deadline - clock() > slice_end:
+            time.sleep(COMMAND_POLL)
+            if posted.value > seen:
+                return None
+        return self.timer.wait_until(deadline)
+
+    def _complete(self, motor, move: "_Move") -> None:
+        motor._reports.put(move.stats.report())
+        with self.cond:
+            motor._completed.value = move.move_id
+            self.cond.notify_all()
+
+    @staticmethod
+    def _new_move(m, move_id: int, half_steps: int, profile, mode: str, delay: float,
+                  entry_velocity: float | None = None, scale: float = 1.0) -> "_Move":
+        dir_sign = 1 if half_steps > 0 else -1
+        num_steps = abs(half_steps)
+        drive = m.drive_tables[mode][dir_sign > 0]
+        stride = max(moved for _, moved in drive)
+        table = None
+        if profile:
+            from motion_profiles import delay_table
+            if entry_velocity is not None:
+                # bucket the speed so retargets keep hitting the table cache
+                entry_velocity = round(entry_velocity, -1)
+            # one entry per shift (+1 in case the phase needs realigning)
+            shifts = -(-num_steps // stride) + stride - 1
+            table = delay_table(profile, shifts, entry_velocity).tolist()
+        move = _Move(move_id, num_steps, dir_sign, table, drive, profile, mode)
+        move.scale = scale
+        move.delay = delay
+        return move
+
+    def _drop(self, m, current: list, pending: deque, cancelled: set,
+              kind: str, move_id: int) -> None:
+        """Handle a 'cancel' of move_id or a 'flush' of every move up to
+        it.  The running move stops where it is; queued ones are
+        completed in order, so a move is never reported done before the
+        moves ahead of it."""
+        slot = m._slot
+        move = current[slot]
+        if kind == 'cancel':
+            if move is not None and move.move_id == move_id and not move.internal:
+                current[slot] = None
+                self._complete(m, move)
+            elif any(p[0] == move_id for p in pending):
+                cancelled.add(move_id)
+            return
+        if move is not None and not move.internal and move.move_id <= move_id:
+            current[slot] = None
+            self._complete(m, move)
+        while pending and pending[0][0] <= move_id:
+            self._complete(m, _Move(pending.popleft()[0], 0, 0, None, None))
+        cancelled.difference_update([i for i in cancelled if i <= move_id])
+
+    def _retarget(self, m, move: "_Move", pending: deque, move_id: int,
+                  target: int, profile, mode: str, delay: float):
+        """
+        Replace a running move with one ending at absolute half-step
+        `target`.  Returns the move that takes over right away; anything
+        that has to follow it is pushed onto the front of `pending`.
+        """
+        remaining = target - m._position.value
+        v = move.velocity()
+        if not profile or v is None:
+            if remaining == 0:
+                return None
+            return self._new_move(m, move_id, remaining, profile, mode, delay)
+        from motion_profiles import brake_table, stopping_distance
+        stride = max(moved for _, moved in move.drive)
+        stop = stopping_distance(profile, v) * stride
+        if remaining * move.dir_sign >= stop:
+            # same direction with room to stop: carry on at speed
+            return self._new_move(m, move_id, remaining, profile, mode, delay, v)
+        # overshooting or reversing: brake along the current direction
+        # first, then head for the target from standstill
+        pending.appendleft((move_id, 'steps', target, profile, mode, 1.0, delay))
+        brake = _Move(0, stop, move.dir_sign, brake_table(profile, v).tolist(),
+                      move.drive, profile, move.mode)
+        brake.internal = True
+        return brake
+
+    def _play(self, m, move_id: int, timeline: tuple, inbox: deque, seen: int) -> int:
+        """
+        Stream a motion_program timeline to the shifter, keeping every
+        motor in it up to date shift by shift.  Commands that arrive
+        meanwhile are read into inbox (for _run to handle afterwards),
+        so a cancel or flush of this move can stop it.  Returns the new
+        count of commands read.
+        """
+        times, words, mask, slots, positions, phases, duration = timeline
+        motors = [self.motors[slot] for slot in slots]
+        start = [motor._position.value for motor in motors]
+        shifter = self.shifter
+        timer = self.timer
+        telemetry = self.telemetry
+        recorder = self.recorder
+        clock = time.perf_counter
+        queue = self._queue
+        posted = self._posted
+        slot = m._slot
+        move = _Move(move_id, 0, 0, None, None)
+        stop = False
+        t0 = clock()
+        count = len(times)
+        for k in range(count + 1):
+            # the last wait is to the end of the program (a closing dwell)
+            due = t0 + (times[k] if k < count else duration)
+            late = None
+            while late is None and not stop:
+                late = self._wait(due, seen)
+                while posted.value > seen:
+                    cmd = queue.get()
+                    seen += 1
+                    inbox.append(cmd)
+                    for c in cmd or ():
+                        if c[0] == slot and (c[2] == 'cancel' and c[3] == move_id
+                                             or c[2] == 'flush' and c[3] >= move_id):
+                            stop = True
+            if stop or k == count:
+                break
+            now = clock()
+            word = (shifter.frame & ~mask) | words[k]
+            if telemetry is None:
+                shifter.write(word)
+            else:
+                shifter.write(word)
+                telemetry.record(now, m._slot, move_id, late, clock() - now)
+            if recorder is not None:
+                recorder.shift(now, word)
+            for j, motor in enumerate(motors):
+                motor._position.value = start[j] + positions[k][j]
+                motor._phase.value = phases[k][j]
+            move.stats.step(now, late, timer.late_threshold)
+        if move.stats.steps > 1:
+            move.stats.nominal = times[move.stats.steps - 1] - times[0]
+        self._complete(m, move)
+        return seen
+
+    def _reject(self, m, move_id: int) -> None:
+        """Finish a move the worker could not run, and say why on stderr."""
+        print(f"step worker: move {move_id} failed, skipped:", file=sys.stderr)
+        traceback.print_exc()
+        self._complete(m, _Move(move_id, 0, 0, None, None))
+
+    def _run(self) -> None:
+        motors = self.motors
+        n = len(motors)
+        shifter = self.shifter
+        queue = self._queue
+        posted = self._posted
+        timer = self.timer
+        telemetry = self.telemetry
+        recorder = self.recorder
+        late_threshold = timer.late_threshold
+        clock = time.perf_counter
+        pending = [deque() for _ in range(n)]
+        current = [None] * n  # _Move per motor
+        due = [0.0] * n       # absolute clock() time each motor's next step is due
+        masks = [0b1111 << m.shifter_bit_start for m in motors]
+        coils = [[c << m.shifter_bit_start for c in m.seq] for m in motors]
+        cancelled = [set() for _ in range(n)]  # queued move ids to skip
+        inbox = deque()       # commands _play() read ahead of us
+        dirty = [m._dirty for m in motors if m._dirty is not None]
+        moving = False        # dirty flags set (see Stepper.use_state)
+        seen = 0
+        stopping = False
+
+        while True:
+            # ----- commands -----
+            idle = not any(current) and not any(pending)
+            if idle and recorder is not None:
+                recorder.flush()  # write trace records while nothing is due
+            if idle and moving:
+                for flag in dirty:  # every motor at rest: positions are final
+                    flag.value = 0
+                moving = False
+            if idle and stopping:
+                return
+            while (idle and not stopping) or posted.value > seen or inbox:
+                if inbox:
+                    cmd = inbox.popleft()
+                else:
+                    cmd = queue.get()
+                    seen += 1
+                idle = False
+                if cmd is None:
+                    stopping = True
+                    continue
+                for slot, move_id, kind, value, profile, mode, scale, delay in cmd:
+                    if kind == 'cancel' or kind == 'flush':
+                        self._drop(motors[slot], current, pending[slot], cancelled[slot],
+                                   kind, value)
+                        continue
+                    if kind != 'retarget':
+                        pending[slot].append((move_id, kind, value, profile, mode, scale, delay))
+                        continue
+                    try:
+                        # Preempt: the new target replaces whatever this motor
+                        # was doing or about to do.
+                        # Moves finish in order: the running one first, then
+                        # the queued ones, so _completed only ever goes up.
+                        m = motors[slot]
+                        move = current[slot]
+                        if move is not None and not move.internal:
+                            self._complete(m, move)
+                        while pending[slot]:
+                            self._complete(m, _Move(pending[slot].popleft()[0], 0, 0, None, None))
+                        target = m._position.value + int(m._shortest_delta(value) * m.steps_per_degree)
+                        if move is None:
+                            pending[slot].append((move_id, 'steps', target, profile, mode, scale, delay))
+                            continue
+                        current[slot] = self._retarget(m, move, pending[slot], move_id,
+                                                       target, profile, mode, delay)
+                        if current[slot] is None:
+                            self._complete(m, _Move(move_id, 0, 0, None, None))
+                    except Exception:
+                        # one bad command must not stop every motor on
+                        # this shifter; fail just that move
+                        current[slot] = None
+                        self._reject(motors[slot], move_id)
+
+            # ----- start moves on idle motors -----
+            for i in range(n):
+                while current[i] is None and pending[i]:
+                    move_id, kind, value, profile, mode, scale, delay = pending[i].popleft()
+                    if not moving:
+                        for flag in dirty:
+                            flag.value = 1
+                        moving = True
+                    m = motors[i]
+                    try:
+                        if move_id in cancelled[i]:
+                            cancelled[i].discard(move_id)
+                            self._complete(m, _Move(move_id, 0, 0, None, None))
+                            continue
+                        if kind == 'zero':
+                            m._position.value = 0
+                            self._complete(m, _Move(move_id, 0, 0, None, None))
+                            continue
+                        if kind == 'timeline':
+                            # a compiled motion program: runs to the end
+                            # before anything else on this shifter moves
+                            seen = self._play(m, move_id, value, inbox, seen)
+                            continue
+                        if kind == 'segment':
+                            # (absolute half-step target, seconds): constant rate,
+                            # no profile, so consecutive segments flow together
+                            target, duration = value
+                            half_steps = target - m._position.value
+                            due[i] = max(due[i], clock())
+                            if half_steps == 0:
+                                current[i] = _Move(move_id, 0, 0, None, None)  # dwell
+                                due[i] += duration
+                                continue
+                            move = self._new_move(m, move_id, half_steps, None, mode, delay)
+                            stride = max(moved for _, moved in move.drive)
+                            shifts = -(-abs(half_steps) // stride)
+                            move.scale = duration * 1e6 / (shifts * delay)
+                            current[i] = move
+                            continue
+                        if kind == 'steps':      # absolute half-step target
+                            half_steps = value - m._position.value
+                        elif kind == 'goto':
+                            # resolved now, against where the previous moves left us
+                            half_steps = int(m._shortest_delta(value) * m.steps_per_degree)
+                        else:
+                            half_steps = int(value * m.steps_per_degree)
+                        if half_steps == 0:
+                            self._complete(m, _Move(move_id, 0, 0, None, None))
+                            continue
+                        current[i] = self._new_move(m, move_id, half_steps, profile, mode, delay,
+                                                    scale=scale)
+                        # back-to-back moves still honour the last step's delay
+                        due[i] = max(due[i], clock())
+                    except Exception:
+                        current[i] = None
+                        self._reject(m, move_id)
+
+            if not any(current):
+                continue
+
+            # ----- wait for the earliest deadline -----
+            next_due = min(due[i] for i in range(n) if current[i] is not None)
+            if self._wait(next_due, seen) is None:
+                continue  # new commands first (a dwell must not hold them up)
+
+            # ----- one tick: step every motor that is due, shift once -----
+            now = clock()
+            horizon = now + MERGE_WINDOW
+            word = shifter.frame
+            stepped = []
+            finished = []
+            for i in range(n):
+                move = current[i]
+                if move is None or due[i] > horizon:
+                    continue
+                m = motors[i]
+                if move.dir_sign == 0:
+                    # a dwell that has run its time
+                    current[i] = None
+                    finished.append((m, move))
+                    continue
+                dir_sign = move.dir_sign
+                phase, moved = move.drive[m._phase.value]
+                if moved > move.steps_left:
+                    # last half-step of a full/wave move: land exactly
+                    phase, moved = (m._phase.value + dir_sign) % 8, 1
+                m._phase.value = phase
+                word = (word & ~masks[i]) | coils[i][phase]
+                m._position.value += dir_sign * moved
+                move.stats.step(now, now - due[i], late_threshold)
+                table = move.table
+                wait = (table[move.index] if table is not None else move.delay) * move.scale / 1e6
+                if move.index < len(table or ()) - 1:
+                    move.index += 1
+                move.steps_left -= moved
+                if move.steps_left <= 0:
+                    current[i] = None
+                    finished.append((m, move))
+                else:
+                    move.stats.nominal += wait
+                stepped.append((i, wait, move.move_id))
+            if telemetry is None:
+                shifter.write(word)
+            else:
+                t0 = clock()
+                shifter.write(word)
+                shift = clock() - t0
+                for i, _, move_id in stepped:
+                    telemetry.record(now, i, move_id, now - due[i], shift)
+            if recorder is not None:
+                recorder.shift(now, word)
+
+            for i, wait, _ in stepped:
+                if now - due[i] > wait:
+                    # more than a whole step behind (a stall in the OS):
+                    # don't try to catch up with a burst of fast steps
+                    due[i] = now
+                due[i] += wait
+            for m, move in finished:
+                if not move.internal:
+                    self._complete(m, move)
+
+
+class _Move:
+    """A move in progress on one motor (worker-side state)."""
+
+    __slots__ = ('move_id', 'steps_left', 'dir_sign', 'table', 'drive', 'profile',
+                 'mode', 'scale', 'delay', 'index', 'stats', 'internal')
+
+    def __init__(self, move_id: int, num_steps: int, dir_sign: int, table, drive,
+                 profile=None, mode: str = 'half'):
+        self.move_id = move_id
+        self.steps_left = num_steps  # half-steps still to go
+        self.dir_sign = dir_sign
+        self.table = table      # per-shift delays (us) or None for `delay`
+        self.drive = drive      # Stepper.drive_tables[mode][direction]
+        self.profile = profile
+        self.mode = mode
+        self.scale = 1.0        # stretch factor on every delay (coordinated moves)
+        self.delay = 0.0        # constant step delay (us), the motor's when submitted
+        self.index = 0
+        self.stats = MoveStats(move_id)
+        self.internal = False   # scheduler-made (braking), no handle to complete
+
+    def velocity(self) -> float | None:
+        """Current speed in shifts/s, if the move follows a profile and
+        has started."""
+        if self.table is None or self.stats.steps == 0:
+            return None
+        return 1e6 / (self.table[self.index - 1 if self.index else 0] * self.scale)
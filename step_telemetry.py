@@ -0,0 +1,156 @@
+# step_telemetry.py
+#
+# Optional per-step telemetry for the step scheduler.
+#
+# When a motor stalls or runs sluggishly we want to know why: were its
+# steps late (sleep overshoot, the OS stalling the worker) or was the
+# shift itself slow?  StepTelemetry is a fixed-size ring buffer in
+# shared memory that the scheduler worker appends one record to per
+# step:
+#
+#     t       perf_counter time the step was taken, s
+#     slot    the motor's slot on its scheduler
+#     move    move id (0 for the scheduler's own braking moves)
+#     late    how far past its deadline the step was, s
+#     shift   how long the shifter.write() of that tick took, s
+#
+# The worker only writes; any process can read.  With telemetry off
+# the step path pays one `is None` check per tick.
+#
+# (The step path takes no locks since the scheduler owns the shifter,
+# so there is no lock wait to record; lateness covers the same ground.)
+#
+# Example:
+#
+#     tel = m.enable_telemetry()
+#     m.goAngle(180).wait()
+#     print(m.telemetry_summary())        # jitter percentiles, shift times
+#     print(tel.moves(slot=m._slot))      # {move_id: MoveRate}
+
+import multiprocessing
+from typing import NamedTuple
+import numpy as np
+
+FIELDS = ('t', 'slot', 'move', 'late', 'shift')
+RECORD = np.dtype([(name, 'f8') for name in FIELDS])
+
+# Default histogram bin edges for lateness and shift time, seconds.
+# The last bin catches everything above 1 ms.
+BINS = (0.0, 10e-6, 25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, np.inf)
+
+
+class TelemetrySummary(NamedTuple):
+    steps: int
+    late_p50: float       # lateness percentiles, s
+    late_p90: float
+    late_p99: float
+    late_max: float
+    shift_p50: float      # shifter.write() duration percentiles, s
+    shift_p99: float
+    shift_max: float
+
+
+class MoveRate(NamedTuple):
+    steps: int
+    duration: float       # s from first to last step
+    rate: float           # achieved steps/s
+
+
+class StepTelemetry:
+
+    def __init__(self, capacity: int = 65536):
+        """capacity: number of step records kept (older ones are overwritten)."""
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._width = len(FIELDS)
+        self._buf = multiprocessing.RawArray('d', capacity * self._width)
+        self._head = multiprocessing.RawValue('q', 0)  # records written, ever
+
+    # ---------- writer (scheduler worker) ----------
+
+    def record(self, t: float, slot: int, move_id: int, late: float, shift: float) -> None:
+        n = self._head.value
+        j = (n % self.capacity) * self._width
+        self._buf[j:j + self._width] = (t, slot, move_id, late, shift)
+        self._head.value = n + 1
+
+    # ---------- readers ----------
+
+    def __len__(self) -> int:
+        return min(self._head.value, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        """Records lost because the ring wrapped."""
+        return max(self._head.value - self.capacity, 0)
+
+    def clear(self) -> None:
+        """Forget everything recorded so far (call while idle)."""
+        self._head.value = 0
+
+    def records(self, slot: int | None = None, move_id: int | None = None) -> np.ndarray:
+        """
+        Copy of the buffered records, oldest first, as a structured
+        array with fields FIELDS.  Optionally only one motor's steps, or
+        one move's (move ids are per motor, so give the slot too).
+        """
+        view = np.frombuffer(self._buf, dtype='f8').reshape(self.capacity, self._width)
+        end = self._head.value
+        start = max(end - self.capacity, 0)
+        rows = view[np.arange(start, end) % self.capacity]
+        # The worker may have lapped us while we copied: drop the rows
+        # it could have overwritten.
+        overwritten = self._head.value - self.capacity - start
+        if overwritten > 0:
+            rows = rows[overwritten:]
+        recs = np.ascontiguousarray(rows).view(RECORD).ravel()
+        if slot is not None:
+            recs = recs[recs['slot'] == slot]
+        if move_id is not None:
+            recs = recs[recs['move'] == move_id]
+        return recs
+
+    def summary(self, slot: int | None = None, move_id: int | None = None) -> TelemetrySummary | None:
+        """Lateness and shift-time percentiles, or None if nothing matched."""
+        recs = self.records(slot, move_id)
+        if len(recs) == 0:
+            return None
+        late = np.percentile(recs['late'], (50, 90, 99))
+        shift = np.percentile(recs['shift'], (50, 99))
+        return TelemetrySummary(
+            steps=len(recs),
+            late_p50=float(late[0]),
+            late_p90=float(late[1]),
+            late_p99=float(late[2]),
+            late_max=float(recs['late'].max()),
+            shift_p50=float(shift[0]),
+            shift_p99=float(shift[1]),
+            shift_max=float(recs['shift'].max()),
+        )
+
+    def moves(self, slot: int) -> dict[int, MoveRate]:
+        """Achieved step rate of each of one motor's moves still (fully
+        or partly) in the buffer, by move id."""
+        recs = self.records(slot)
+        rates = {}
+        for move_id in np.unique(recs['move']):
+            if move_id == 0:
+                continue  # scheduler-made braking moves
+            t = recs['t'][recs['move'] == move_id]
+            duration = float(t[-1] - t[0])
+            rates[int(move_id)] = MoveRate(
+                steps=len(t),
+                duration=duration,
+                rate=(len(t) - 1) / duration if duration > 0 else 0.0,
+            )
+        return rates
+
+    def histogram(self, field: str = 'late', bins=BINS, slot: int | None = None):
+        """(counts, bin edges) of one field, by default lateness."""
+        values = self.records(slot)[field]
+        edges = np.asarray(bins, dtype=float)
+        # values below the first edge (steps merged into a tick a little
+        # early) land in the first bin, values past the last in the last
+        index = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+        return np.bincount(index, minlength=len(edges) - 1), edges
@@ -0,0 +1,131 @@
+# step_timer.py
+#
+# Step timing on absolute deadlines.
+#
+# Sleeping for the step delay after every step lets the shift time and
+# the sleep overshoot pile up on every step, so the motor runs well
+# below its nominal rate.  Here each step has an absolute due time
+# (start + sum of the delays so far) on time.perf_counter, so time spent
+# shifting is taken out of the next wait instead of added to it.
+#
+# time.sleep() on Linux overshoots by 50-100+ us, so StepTimer sleeps
+# until `spin` seconds before the deadline and busy-waits the rest.
+#
+# Example:
+#
+#     timer = StepTimer()
+#     due = time.perf_counter()
+#     for d in delays_us:
+#         late = timer.wait_until(due)   # seconds past the deadline
+#         do_step()
+#         due += d / 1e6
+
+import multiprocessing
+import time
+from typing import NamedTuple
+
+
+class MoveReport(NamedTuple):
+    move_id: int
+    steps: int
+    duration: float       # s from first to last step
+    rate: float           # achieved steps/s
+    nominal_rate: float   # steps/s the delay table asked for
+    late_steps: int       # steps taken more than late_threshold after due
+    max_late: float       # worst lateness, s
+
+
+class ReportRing:
+    """
+    The MoveReports of one motor's last `size` moves, in shared memory.
+
+    The scheduler worker writes a report into slot move_id % size as it
+    finishes each move and any process reads them back by id.  Nothing
+    has to drain it, so it never fills up however many moves run.
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._width = len(MoveReport._fields)
+        self._buf = multiprocessing.RawArray('d', size * self._width)
+
+    def put(self, report: MoveReport) -> None:
+        j = (report.move_id % self.size) * self._width
+        # the id goes in last, so a reader never matches a half-written row
+        self._buf[j] = 0
+        self._buf[j + 1:j + self._width] = report[1:]
+        self._buf[j] = report.move_id
+
+    def get(self, move_id: int) -> MoveReport | None:
+        """The report of move_id, or None if unknown or overwritten."""
+        if move_id <= 0:
+            return None
+        j = (move_id % self.size) * self._width
+        row = self._buf[j:j + self._width]
+        if row[0] != move_id or self._buf[j] != move_id:
+            return None  # not written yet, or lapped while we read
+        return MoveReport(move_id, int(row[1]), row[2], row[3], row[4], int(row[5]), row[6])
+
+
+class StepTimer:
+
+    def __init__(self, spin: float = 300e-6, late_threshold: float = 100e-6):
+        """
+        spin:
+            how long before a deadline to stop sleeping and busy-wait (s).
+        late_threshold:
+            a step this far (s) past its deadline counts as late.
+        """
+        self.spin = spin
+        self.late_threshold = late_threshold
+
+    def wait_until(self, deadline: float) -> float:
+        """Return at `deadline` (perf_counter time).  Returns how late
+        we already were if the deadline had passed, else 0."""
+        clock = time.perf_counter
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return -remaining
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while clock() < deadline:
+            pass
+        return 0.0
+
+
+class MoveStats:
+    """Per-move timing, accumulated by the scheduler as it steps."""
+
+    __slots__ = ('move_id', 'steps', 'first', 'last', 'nominal', 'late', 'max_late')
+
+    def __init__(self, move_id: int):
+        self.move_id = move_id
+        self.steps = 0
+        self.first = 0.0
+        self.last = 0.0
+        self.nominal = 0.0   # sum of the delays between recorded steps
+        self.late = 0
+        self.max_late = 0.0
+
+    def step(self, t: float, lateness: float, late_threshold: float) -> None:
+        if self.steps == 0:
+            self.first = t
+        self.steps += 1
+        self.last = t
+        if lateness > late_threshold:
+            self.late += 1
+        if lateness > self.max_late:
+            self.max_late = lateness
+
+    def report(self) -> MoveReport:
+        duration = self.last - self.first
+        intervals = self.steps - 1
+        return MoveReport(
+            move_id=self.move_id,
+            steps=self.steps,
+            duration=duration,
+            rate=intervals / duration if duration > 0 else 0.0,
+            nominal_rate=intervals / self.nominal if self.nominal > 0 else 0.0,
+            late_steps=self.late,
+            max_late=self.max_late,
+        )
@@ -0,0 +1,43 @@
+# test_gpio_backend.py
+#
+#     python -m pytest test_gpio_backend.py
+
+import os
+import subprocess
+import sys
+
+import gpio_backend
+
+
+def test_no_silent_fallback_to_the_simulator():
+    # Without RPi.GPIO and without ENME441_GPIO=sim, GPIO calls must fail.
+    code = "import gpio_backend; gpio_backend.GPIO.setmode(11)"
+    env = {k: v for k, v in os.environ.items() if k != "ENME441_GPIO"}
+    env["PYTHONPATH"] = os.path.dirname(os.path.abspath(__file__))
+    blocker = "import sys; sys.modules['RPi'] = None; "  # even on a Pi
+    proc = subprocess.run([sys.executable, "-c", blocker + code], env=env,
+                          capture_output=True, text=True, timeout=30)
+    assert proc.returncode != 0 and "ENME441_GPIO=sim" in proc.stderr
+
+
+def test_shared_trace_sees_the_step_worker():
+    from shifter import Shifter
+    from Lab8_4 import Stepper
+    sim = gpio_backend.use_simulator(shared=100_000)
+    m = Stepper(Shifter(data=16, clock=20, latch=21))
+    m.rotate(10).wait(5.0)
+    assert sim.trace.count(21, 1) == m.position  # one latch per half-step
+    m.close()
+
+
+def test_reopened_shifter_uses_the_new_backend():
+    from shifter import Shifter
+    first = gpio_backend.use_simulator()
+    s = Shifter(data=16, clock=20, latch=21)
+    s.write(0x55)
+    s.close()
+    second = gpio_backend.use_simulator()  # bound again by the next open
+    s.write(0xAA)
+    assert first.trace.count(21, 1) == 2   # write + clear on close
+    assert second.trace.count(21, 1) == 1
+    s.close()
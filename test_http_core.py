@@ -0,0 +1,103 @@
+# test_http_core.py
+#
+#     python -m pytest test_http_core.py
+
+import socket
+import threading
+import time
+
+import pytest
+from http_core import MAX_BODY, HttpServer
+
+
+def echo(request: str) -> bytes:
+    """Answer with the request's path and body."""
+    head, _, body = request.partition("\r\n\r\n")
+    reply = (head.split(" ")[1] + " " + body).encode()
+    return (f"HTTP/1.1 200 OK\r\nContent-Length: {len(reply)}\r\n\r\n").encode() + reply
+
+
+@pytest.fixture
+def server():
+    srv = HttpServer(echo, host="127.0.0.1", port=0)
+    thread = threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield srv
+    srv.stop()
+    thread.join(1.0)
+    srv.close()
+
+
+def connect(srv) -> socket.socket:
+    sock = socket.create_connection(("127.0.0.1", srv.port), timeout=2.0)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def read_response(sock, buf: bytearray) -> tuple[str, bytes]:
+    """Read one response from sock (leftovers stay in buf): (head, body)."""
+    while b"\r\n\r\n" not in buf:
+        data = sock.recv(4096)
+        assert data, "connection closed before a response"
+        buf += data
+    end = buf.index(b"\r\n\r\n")
+    head = buf[:end].decode()
+    length = int(head.lower().split("content-length:")[1].split("\r\n")[0])
+    while len(buf) < end + 4 + length:
+        buf += sock.recv(4096)
+    body = bytes(buf[end + 4:end + 4 + length])
+    del buf[:end + 4 + length]
+    return head, body
+
+
+def post(path: str, body: bytes) -> bytes:
+    return (f"POST {path} HTTP/1.1\r\nHost: x\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n").encode() + body
+
+
+def closed(sock) -> bool:
+    try:
+        return sock.recv(1) == b""
+    except ConnectionResetError:
+        return True
+
+
+def test_keep_alive_reuses_the_connection(server):
+    sock, buf = connect(server), bytearray()
+    for i in range(3):
+        sock.sendall(post("/led", b"%d" % i))
+        head, body = read_response(sock, buf)
+        assert head.startswith("HTTP/1.1 200") and "connection: close" not in head.lower()
+        assert body == b"/led %d" % i
+    assert server.requests == 3 and len(server.connections) == 1
+    sock.close()
+
+
+def test_pipelined_requests_are_answered_in_order(server):
+    sock, buf = connect(server), bytearray()
+    sock.sendall(post("/a", b"first") + post("/b", b"second"))
+    assert read_response(sock, buf)[1] == b"/a first"
+    assert read_response(sock, buf)[1] == b"/b second"
+    sock.close()
+
+
+def test_body_split_across_recv_calls(server):
+    sock, buf = connect(server), bytearray()
+    request = post("/led", b"0=255&1=128")
+    for part in (request[:10], request[10:-6], request[-6:]):
+        sock.sendall(part)
+        time.sleep(0.05)        # each part arrives in its own recv()
+    assert read_response(sock, buf)[1] == b"/led 0=255&1=128"
+    assert server.requests == 1
+    sock.close()
+
+
+@pytest.mark.parametrize("length", [str(MAX_BODY + 1), "-1", "twelve"])
+def test_bad_content_length_is_rejected(server, length):
+    sock, buf = connect(server), bytearray()
+    sock.sendall(f"POST /led HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+    head, _ = read_response(sock, buf)
+    assert head.startswith("HTTP/1.1 400") and "connection: close" in head.lower()
+    assert closed(sock)
+    assert server.requests == 0
+    sock.close()
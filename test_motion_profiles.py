@@ -0,0 +1,20 @@
+# test_motion_profiles.py
+#
+#     python -m pytest test_motion_profiles.py
+
+from motion_profiles import MotionProfile, delay_table, stopping_distance
+
+
+def test_entry_velocity_is_kept_and_braking_ends_on_the_last_step():
+    p = MotionProfile(max_velocity=1600, acceleration=4000)
+    stop = stopping_distance(p, 1600)
+
+    # exactly enough room to stop: brake from full speed, not below it
+    table = delay_table(p, stop, 1600.0)
+    assert 1e6 / table[0] > 1550
+    assert 1e6 / table[-1] < 900
+
+    # twice that: cruise for the first half, brake over the second
+    table = delay_table(p, 2 * stop, 1600.0)
+    assert 1e6 / table[stop - 1] > 1550
+    assert table.sum() / 1e6 < 0.36
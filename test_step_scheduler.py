@@ -0,0 +1,155 @@
+# test_step_scheduler.py
+#
+# Regression tests for the step scheduler, run against the GPIO
+# simulator (no Pi needed):
+#
+#     python -m pytest test_step_scheduler.py
+
+import os
+os.environ.setdefault("ENME441_GPIO", "sim")
+
+import multiprocessing
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from shifter import Shifter
+from Lab8_4 import Stepper, start_together
+from step_scheduler import StepScheduler
+
+
+def returns_within(fn, timeout: float) -> bool:
+    """Run fn in a thread; True if it finished within timeout seconds."""
+    t = threading.Thread(target=fn, daemon=True)
+    t.start()
+    t.join(timeout)
+    return not t.is_alive()
+
+
+def test_many_moves_do_not_block_worker_restart():
+    # Every finished move leaves a report behind.  Nobody reads most of
+    # them, which must not stop the worker from exiting (close() is
+    # what telemetry, recording and attach() use to restart it).
+    s = Shifter(data=16, latch=20, clock=21)
+    m = Stepper(s)
+    m.delay = 20
+    handles = [m.rotate(0.1) for _ in range(3000)]
+    assert m.wait_idle(30)
+    assert returns_within(m.enable_telemetry, 5.0)
+    assert returns_within(lambda: Stepper(s), 5.0)
+    assert handles[-1].report().steps == 1
+    assert handles[0].report() is None  # long since overwritten
+    m.close()
+
+
+def test_cancelling_two_queued_moves_skips_both():
+    s = Shifter(data=16, latch=20, clock=21)
+    m = Stepper(s)
+    m.delay = 200
+    h1, h2, h3 = m.rotate(30), m.rotate(30), m.rotate(30)
+    assert h2.cancel() and h3.cancel()
+    assert m.wait_idle(10)
+    assert m.position == h1.report().steps == 341
+    assert h2.report().steps == h3.report().steps == 0
+    m.close()
+
+
+def test_dwell_does_not_delay_other_motors():
+    s = Shifter(data=16, latch=20, clock=21)
+    m1, m2 = Stepper(s), Stepper(s)
+    m1.delay = m2.delay = 200
+    start_together((m1, 'segment', (0, 3.0), None, 1.0))  # hold still for 3 s
+    time.sleep(0.05)
+    start = time.perf_counter()
+    assert m2.rotate(1).wait(1.0)
+    assert time.perf_counter() - start < 0.5
+    assert m1.cancel() and m1.wait_idle(0.5)
+    m1.close()
+
+
+def test_delay_changes_apply_to_the_next_move():
+    s = Shifter(data=16, latch=20, clock=21)
+    m = Stepper(s)
+    m.rotate(1).wait()         # the worker is running from here on
+    m.delay = 5000
+    report = m.rotate(5).report(5.0)
+    assert abs(report.duration - m.move_time(report.steps - 1)) < 0.05
+    m.close()
+
+
+def test_profiled_moves_do_not_load_numpy_mid_move():
+    # Needs an interpreter that has not loaded NumPy yet.
+    code = """
+import sys, time
+from shifter import Shifter
+from Lab8_4 import Stepper
+s = Shifter(data=16, latch=20, clock=21)
+m1, m2 = Stepper(s), Stepper(s)
+m1.rotate(1).wait()              # worker forked before any profile was set
+h = m1.rotate(60)
+time.sleep(0.1)
+from motion_profiles import MotionProfile
+m2.profile = MotionProfile(max_velocity=1600, acceleration=4000)
+m2.rotate(30).wait(5.0)          # first profiled move, while m1 is moving
+sys.exit(0 if h.report(5.0).max_late < 0.05 else 1)
+"""
+    env = dict(os.environ, ENME441_GPIO="sim")
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    assert subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, timeout=30).returncode == 0
+
+
+def test_moves_run_after_the_worker_restarts():
+    s = Shifter(data=16, latch=20, clock=21)
+    m = Stepper(s)
+    m.delay = 200
+    assert m.rotate(1).wait(5.0)
+    s._scheduler.close()
+    assert m.rotate(1).wait(5.0)          # first move of a new worker
+    h = m.rotate(30)
+    s._scheduler.close(timeout=0.01)      # gives up while h is running
+    assert m.rotate(1).wait(5.0) and h.done()
+    assert m.position == 11 + 11 + 341 + 11
+    m.close()
+
+
+def test_retarget_completes_moves_in_order(monkeypatch):
+    # Record every completion the (forked) worker makes, in order.
+    done = multiprocessing.RawArray('q', 32)
+    count = multiprocessing.RawValue('i', 0)
+    complete = StepScheduler._complete
+
+    def spy(self, motor, move):
+        done[count.value] = move.move_id
+        count.value += 1
+        complete(self, motor, move)
+
+    monkeypatch.setattr(StepScheduler, '_complete', spy)
+    s = Shifter(data=16, latch=20, clock=21)
+    m = Stepper(s)
+    m.delay = 200
+    m.goAngle(90), m.goAngle(180), m.goAngle(10)
+    time.sleep(0.05)
+    m.retarget(45)
+    assert m.wait_idle(5.0)
+    ids = list(done[:count.value])
+    assert ids == sorted(ids) and ids[-1] == 4
+    m.close()
+
+
+def test_a_bad_move_fails_alone():
+    s = Shifter(data=16, latch=20, clock=21)
+    m1, m2 = Stepper(s), Stepper(s)
+    m1.delay = m2.delay = 200
+    for bad in (float('nan'), float('inf'), '90', None):
+        with pytest.raises(ValueError):
+            m1.goAngle(bad)
+    h2 = m2.rotate(30)
+    # one that gets past the caller anyway must not stop the worker
+    cmd, h1 = m1._command('rotate', 1.0)
+    s._scheduler.submit(cmd[:3] + ('1.0',) + cmd[4:])
+    assert h1.wait(5.0) and h1.report().steps == 0
+    assert m1.rotate(1).wait(5.0) and m1.position == 11
+    assert h2.report(5.0).steps == 341
+    m1.close()
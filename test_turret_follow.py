@@ -0,0 +1,22 @@
+# test_turret_follow.py
+#
+#     python -m pytest test_turret_follow.py
+
+import os
+os.environ.setdefault("ENME441_GPIO", "sim")
+
+import time
+from motion_profiles import MotionProfile
+from turret_motors import TurretMotors
+
+
+def test_follow_does_not_jump_to_top_speed_from_standstill():
+    turret = TurretMotors()
+    turret.pan.profile = turret.tilt.profile = MotionProfile(max_velocity=1600, acceleration=4000)
+    # 20 degrees in 0.15 s is under max_velocity (0.142 s), but from
+    # standstill the profile needs ~0.24 s to get there.
+    start = time.perf_counter()
+    report = turret.follow([(0.0, 0.0, 0.0), (0.15, 20.0, 0.0)])
+    assert report.clamped == 1
+    assert time.perf_counter() - start > 0.23
+    turret.close()
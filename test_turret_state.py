@@ -0,0 +1,34 @@
+# test_turret_state.py
+#
+#     python -m pytest test_turret_state.py
+
+import os
+os.environ.setdefault("ENME441_GPIO", "sim")
+
+import time
+from turret_motors import TurretMotors
+from turret_state import TurretState
+
+
+def settles(flag, value, timeout: float = 1.0) -> bool:
+    """True once flag.value == value, within timeout seconds."""
+    end = time.monotonic() + timeout
+    while flag.value != value:
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def test_dirty_only_while_moving(tmp_path):
+    path = str(tmp_path / "state")
+    turret = TurretMotors(state_file=path)
+    turret.pan.delay = 2000
+    assert turret.state.dirty.value == 0      # open, standing still
+    turret.goto(90.0, 0.0, sync=False)
+    assert settles(turret.state.dirty, 1)
+    assert not TurretState(path).was_clean    # a crash now: mid-move
+    turret.pan.wait_idle(10)
+    assert settles(turret.state.dirty, 0)
+    assert TurretState(path).was_clean        # a crash now: at rest
+    turret.close()
@@ -4,7 +4,7 @@
 # so you can see which motor/coil responds.
 
 import time
-import RPi.GPIO as GPIO
+from gpio_backend import GPIO
 from shifter import Shifter  # same Shifter class you already use
 
 # === Use the same pins you used before ===
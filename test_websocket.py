@@ -0,0 +1,127 @@
+# test_websocket.py
+#
+# The WebSocket side of http_core, driven through sockets2's handler
+# against the GPIO simulator:
+#
+#     python -m pytest test_websocket.py
+
+import os
+os.environ.setdefault("ENME441_GPIO", "sim")
+
+import socket
+import struct
+import threading
+import time
+
+import pytest
+import gpio_backend
+import sockets2
+from http_core import (WS_BINARY, WS_CLOSE, WS_CONT, WS_PING, WS_PONG,
+                       HttpServer, ws_accept)
+
+KEY = "dGhlIHNhbXBsZSBub25jZQ=="  # the sample handshake in RFC 6455
+
+
+def frame(opcode: int, payload: bytes, fin: bool = True, masked: bool = True) -> bytes:
+    """One client-to-server frame (payloads under 126 bytes)."""
+    head = bytes([(0x80 if fin else 0) | opcode, (0x80 if masked else 0) | len(payload)])
+    if not masked:
+        return head + payload
+    mask = os.urandom(4)
+    return head + mask + bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+
+
+def read_frame(sock) -> tuple[int, bytes]:
+    """(opcode, payload) of the next server frame (never masked)."""
+    head = recv_exactly(sock, 2)
+    n = head[1] & 0x7F
+    if n == 126:
+        n = struct.unpack("!H", recv_exactly(sock, 2))[0]
+    return head[0] & 0x0F, recv_exactly(sock, n)
+
+
+def recv_exactly(sock, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        assert chunk, "connection closed mid-frame"
+        data += chunk
+    return data
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def server():
+    gpio_backend.use_simulator()
+    sockets2.setup_leds()
+    sockets2.levels[:] = [0, 0, 0]
+    srv = HttpServer(sockets2.handle_request, host="127.0.0.1", port=0,
+                     websockets={"/ws": sockets2.handle_ws})
+    thread = threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield srv
+    srv.stop()
+    thread.join(1.0)
+    srv.close()
+    sockets2.release_leds()
+
+
+def upgrade(srv) -> tuple[socket.socket, str]:
+    """Open a WebSocket on /ws: (socket, the server's handshake reply)."""
+    sock = socket.create_connection(("127.0.0.1", srv.port), timeout=2.0)
+    sock.sendall(("GET /ws HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {KEY}\r\n"
+                  "Sec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = b""
+    while not head.endswith(b"\r\n\r\n"):
+        head += recv_exactly(sock, 1)
+    return sock, head.decode()
+
+
+@pytest.fixture
+def ws(server):
+    sock, _ = upgrade(server)
+    yield sock
+    sock.close()
+
+
+def test_handshake_accept_value(server):
+    assert ws_accept(KEY) == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+    sock, head = upgrade(server)
+    assert head.startswith("HTTP/1.1 101")
+    assert "Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n" in head
+    sock.close()
+
+
+def test_masked_binary_frame_sets_the_leds(server, ws):
+    ws.sendall(frame(WS_BINARY, b"\x00\x14\x02\x4d"))  # LED 0 to 20, LED 2 to 77
+    assert wait_for(lambda: server.messages == 1)
+    assert sockets2.levels == [20, 0, 77]
+
+
+def test_fragmented_message_is_joined(server, ws):
+    # split inside a [led, level] pair: only the whole message makes sense
+    ws.sendall(frame(WS_BINARY, b"\x01", fin=False))
+    ws.sendall(frame(WS_CONT, b"\x32\x02", fin=False) + frame(WS_CONT, b"\x05"))
+    assert wait_for(lambda: server.messages == 1)
+    assert sockets2.levels == [0, 50, 5]
+
+
+def test_ping_gets_a_pong(ws):
+    ws.sendall(frame(WS_PING, b"are you there"))
+    assert read_frame(ws) == (WS_PONG, b"are you there")
+
+
+def test_unmasked_client_frame_closes_with_1002(server, ws):
+    ws.sendall(frame(WS_BINARY, b"\x00\x14", masked=False))
+    assert read_frame(ws) == (WS_CLOSE, struct.pack("!H", 1002))
+    assert ws.recv(1) == b""
+    assert server.messages == 0 and sockets2.levels == [0, 0, 0]
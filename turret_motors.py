@@ -12,9 +12,35 @@
 # So if your belt drive is 2:1 (stepper turns 2x turret),
 # set pan_gear_ratio = 2.0, etc.
 
-import multiprocessing
+from collections import deque
+from typing import Iterable, NamedTuple
 from shifter import Shifter
-from Lab8_4 import Stepper  # use your known-good Stepper class
+import multiprocessing
+from Lab8_4 import Stepper, start_together  # use your known-good Stepper class
+from turret_state import TurretState
+
+# asyncio and motion_program (NumPy) are imported by the methods that
+# use them, to keep `import turret_motors` fast.
+
+
+class MovePlan(NamedTuple):
+    """A coordinated pan/tilt move, planned before it runs."""
+    pan_target: int     # absolute stepper position, half-steps
+    tilt_target: int
+    pan_steps: int      # signed half-steps to go
+    tilt_steps: int
+    pan_scale: float    # stretch on each axis' step delays (>= 1)
+    tilt_scale: float
+    duration: float     # planned time for both axes, seconds
+
+
+class FollowReport(NamedTuple):
+    """What follow() did with a waypoint stream."""
+    points: int         # waypoints consumed
+    segments: int       # segments sent to the motors
+    underruns: int      # times both axes ran dry waiting for the producer
+    skipped: int        # waypoints dropped for not moving forward in time
+    clamped: int = 0    # segments slowed down for the motors' speed or acceleration
 
 
 class TurretMotors:
@@ -23,8 +49,10 @@ class TurretMotors:
         data_pin: int = 16,
         latch_pin: int = 20,
         clock_pin: int = 21,
-        pan_gear_ratio: float = 1.0,
-        tilt_gear_ratio: float = 1.0,
+        pan_gear_ratio: float | None = None,
+        tilt_gear_ratio: float | None = None,
+        state_file: str | None = None,
+        shifter: Shifter | None = None,
     ):
         """
         data_pin, latch_pin, clock_pin:
@@ -34,23 +62,56 @@ class TurretMotors:
             stepper_deg / turret_deg for the pan axis
         tilt_gear_ratio:
             stepper_deg / turret_deg for the tilt axis
+            (default: the saved ratio with a state file, else 1.0)
+
+        state_file:
+            path of a turret_state file.  Positions live in it while the
+            turret runs; if it already holds a saved position the turret
+            starts from there instead of zeroing (see self.state.restored
+            and self.state.was_clean).  Call close() on shutdown.
+
+        shifter:
+            an existing (chained) Shifter to put both motors on instead
+            of opening one on the pins above, e.g. two turrets on one
+            16-bit chain, stepped by one worker with one shift per tick:
+                chain = Shifter(data=16, clock=21, latch=20, num_bits=16)
+                left, right = TurretMotors(shifter=chain), TurretMotors(shifter=chain)
         """
-        self.shifter = Shifter(data=data_pin, latch=latch_pin, clock=clock_pin)
-        self.lock = multiprocessing.Lock()
+        # No pins are touched until open() or the first move.
+        self._owns_shifter = shifter is None
+        if shifter is None:
+            shifter = Shifter(data=data_pin, latch=latch_pin, clock=clock_pin)
+        self.shifter = shifter
 
-        # NOTE: Stepper.num_steppers controls which 4 bits each motor uses.
+        # NOTE: each Stepper takes the next 4 free bits of this shifter.
         # The first Stepper created uses bits 0–3, the second uses bits 4–7.
         # We'll treat the first as PAN (azimuth) and the second as TILT.
-        self.pan = Stepper(self.shifter, self.lock)
-        self.tilt = Stepper(self.shifter, self.lock)
+        # Both are stepped by the shifter's scheduler, one shift per tick.
+        self.pan = Stepper(self.shifter)
+        self.tilt = Stepper(self.shifter)
+
+        self.state = None
+        restored = False
+        if state_file is not None:
+            self.state = TurretState(state_file)
+            restored = self.state.restored
+            self.pan.use_state(self.state.pan_position, self.state.pan_phase, self.state.dirty)
+            self.tilt.use_state(self.state.tilt_position, self.state.tilt_phase, self.state.dirty)
+            if restored:
+                if pan_gear_ratio is None:
+                    pan_gear_ratio = self.state.pan_gear_ratio.value
+                if tilt_gear_ratio is None:
+                    tilt_gear_ratio = self.state.tilt_gear_ratio.value
 
         # Gear ratios (stepper_deg / turret_deg).
         # You will tune these later as you test the belt drive.
-        self.pan_gear_ratio = pan_gear_ratio
-        self.tilt_gear_ratio = tilt_gear_ratio
+        self.pan_gear_ratio = 1.0 if pan_gear_ratio is None else pan_gear_ratio
+        self.tilt_gear_ratio = 1.0 if tilt_gear_ratio is None else tilt_gear_ratio
+        self._save_gear_ratios()
 
-        # Start with logical 0° for both axes
-        self.zero()
+        # Start with logical 0° for both axes, unless we know better
+        if not restored:
+            self.zero()
 
     # ---------- calibration / configuration ----------
 
@@ -63,6 +124,12 @@ class TurretMotors:
             self.pan_gear_ratio = pan_ratio
         if tilt_ratio is not None:
             self.tilt_gear_ratio = tilt_ratio
+        self._save_gear_ratios()
+
+    def _save_gear_ratios(self) -> None:
+        if self.state is not None and not self.state.closed:
+            self.state.pan_gear_ratio.value = self.pan_gear_ratio
+            self.state.tilt_gear_ratio.value = self.tilt_gear_ratio
 
     def zero(self) -> None:
         """
@@ -77,12 +144,12 @@ class TurretMotors:
     @property
     def pan_stepper_angle(self) -> float:
         """Current pan stepper shaft angle in degrees."""
-        return self.pan.angle.value
+        return self.pan.angle
 
     @property
     def tilt_stepper_angle(self) -> float:
         """Current tilt stepper shaft angle in degrees."""
-        return self.tilt.angle.value
+        return self.tilt.angle
 
     @property
     def pan_turret_angle(self) -> float:
@@ -100,16 +167,26 @@ class TurretMotors:
 
     # ---------- main motion API ----------
 
-    def goto(self, pan_deg: float, tilt_deg: float, sync: bool = True):
+    def goto(self, pan_deg: float, tilt_deg: float, sync: bool = True,
+             coordinated: bool = False):
         """
         Move both axes to the requested *turret* angles (in degrees).
 
         Internally converts to stepper shaft angles using gear ratios:
             stepper_target = turret_target * gear_ratio
 
+        If coordinated=True, waits for both axes to stop, then runs
+        plan_goto()'s plan so both axes arrive at the same time.
+
         If sync=True (default), this call blocks until both moves finish.
-        If sync=False, it returns the two Process objects.
+        If sync=False, it returns the two MoveHandle objects
+        (call .join() or .wait() on them, or .cancel()).
         """
+        if coordinated:
+            self.pan.wait_idle()
+            self.tilt.wait_idle()
+            return self.run_plan(self.plan_goto(pan_deg, tilt_deg), sync)
+
         pan_stepper_target = pan_deg * self.pan_gear_ratio
         tilt_stepper_target = tilt_deg * self.tilt_gear_ratio
 
@@ -123,6 +200,45 @@ class TurretMotors:
         else:
             return p_pan, p_tilt
 
+    def plan_goto(self, pan_deg: float, tilt_deg: float) -> MovePlan:
+        """
+        Plan a coordinated move to *turret* angles without moving.
+
+        Each axis' time comes from its own profile (or step delay), drive
+        mode and gear ratio.  The longer one sets the shared duration and
+        the other axis' step delays are stretched to match, so both start
+        and stop together and the path is (close to) a straight line in
+        angle space.  Planned from the current positions, so plan while
+        the axes are idle.
+        """
+        pan_steps = self.pan.half_steps_to(pan_deg * self.pan_gear_ratio)
+        tilt_steps = self.tilt.half_steps_to(tilt_deg * self.tilt_gear_ratio)
+        t_pan = self.pan.move_time(pan_steps)
+        t_tilt = self.tilt.move_time(tilt_steps)
+        duration = max(t_pan, t_tilt)
+        return MovePlan(
+            pan_target=self.pan.position + pan_steps,
+            tilt_target=self.tilt.position + tilt_steps,
+            pan_steps=pan_steps,
+            tilt_steps=tilt_steps,
+            pan_scale=duration / t_pan if t_pan > 0 else 1.0,
+            tilt_scale=duration / t_tilt if t_tilt > 0 else 1.0,
+            duration=duration,
+        )
+
+    def run_plan(self, plan: MovePlan, sync: bool = True):
+        """Execute a plan from plan_goto(); both axes start on the same tick."""
+        p_pan, p_tilt = start_together(
+            (self.pan, 'steps', plan.pan_target, None, plan.pan_scale),
+            (self.tilt, 'steps', plan.tilt_target, None, plan.tilt_scale),
+        )
+        if sync:
+            p_pan.join()
+            p_tilt.join()
+            return None
+        else:
+            return p_pan, p_tilt
+
     def goto_pan(self, pan_deg: float, sync: bool = True):
         """
         Move only the pan axis to a given turret angle.
@@ -146,3 +262,230 @@ class TurretMotors:
             return None
         else:
             return p_tilt
+
+    def track(self, pan_deg: float, tilt_deg: float):
+        """
+        Retarget both axes to new *turret* angles without waiting.
+
+        Unlike goto(), a new setpoint replaces the move in progress
+        instead of queuing behind it, so this can be called at 20-50 Hz
+        to follow a moving target.  Returns the two MoveHandle objects.
+        """
+        p_pan = self.pan.retarget(pan_deg * self.pan_gear_ratio)
+        p_tilt = self.tilt.retarget(tilt_deg * self.tilt_gear_ratio)
+        return p_pan, p_tilt
+
+    def follow(self, waypoints: Iterable, lookahead: int = 8) -> FollowReport:
+        """
+        Run a stream of timestamped waypoints as continuous motion.
+
+        waypoints yields (t, pan_deg, tilt_deg) in *turret* degrees, t in
+        seconds on any clock that only moves forward.  The turret first
+        moves (coordinated) to the first waypoint, then each pair of
+        consecutive waypoints becomes one constant-rate segment per axis
+        lasting exactly their time difference, queued back to back so
+        the motors never stop in between.  A segment faster than either
+        motor may go (its profile's max_velocity, else its step delay)
+        is stretched to that speed instead, which delays the rest of the
+        stream; FollowReport.clamped counts these.  With a profile, the
+        speed may also only rise from one segment to the next as fast as
+        its acceleration allows, from start_velocity when the axis is
+        standing still; segments slowed for that are counted too.
+
+        The iterable is consumed lazily: at most `lookahead` segments are
+        queued ahead of the motors, so generators of endless scan
+        patterns run in constant memory.  If both axes finish everything
+        queued before the next waypoint arrives, that is an underrun.
+        Blocks until the stream ends and the last segment has run.
+        """
+        it = iter(waypoints)
+        first = next(it, None)
+        if first is None:
+            return FollowReport(0, 0, 0, 0)
+        t_prev, pan_deg, tilt_deg = first
+        self.goto(pan_deg, tilt_deg, coordinated=True)
+
+        # Planned positions (half-steps) where the queued segments end;
+        # targets are rounded against these, not the live positions.
+        pan_pos = self.pan.position
+        tilt_pos = self.tilt.position
+        # Rate each axis is stepping at when the next segment starts.
+        pan_rate = tilt_rate = 0.0
+        inflight = deque()
+        points, segments, underruns, skipped, clamped = 1, 0, 0, 0, 0
+
+        while True:
+            while len(inflight) >= lookahead:
+                for h in inflight.popleft():
+                    h.wait()
+            point = next(it, None)
+            if point is None:
+                break
+            points += 1
+            t, pan_deg, tilt_deg = point
+            duration = t - t_prev
+            if duration <= 0:
+                skipped += 1
+                continue
+            t_prev = t
+            pan_steps = self._steps_toward(self.pan, pan_pos, pan_deg * self.pan_gear_ratio)
+            tilt_steps = self._steps_toward(self.tilt, tilt_pos, tilt_deg * self.tilt_gear_ratio)
+            pan_pos += pan_steps
+            tilt_pos += tilt_steps
+            pan_busy, tilt_busy = self.pan.busy(), self.tilt.busy()
+            if not pan_busy:
+                pan_rate = 0.0      # ran dry: starts from standstill
+            if not tilt_busy:
+                tilt_rate = 0.0
+            fastest = max(self.pan.cruise_time(pan_steps, entry_rate=pan_rate),
+                          self.tilt.cruise_time(tilt_steps, entry_rate=tilt_rate))
+            if duration < fastest:
+                duration = fastest
+                clamped += 1
+            pan_rate = self.pan.step_rate(pan_steps, duration)
+            tilt_rate = self.tilt.step_rate(tilt_steps, duration)
+            if inflight and not pan_busy and not tilt_busy:
+                underruns += 1
+            inflight.append(start_together(
+                (self.pan, 'segment', (pan_pos, duration), None, 1.0),
+                (self.tilt, 'segment', (tilt_pos, duration), None, 1.0),
+            ))
+            segments += 1
+
+        for handles in inflight:
+            for h in handles:
+                h.wait()
+        return FollowReport(points, segments, underruns, skipped, clamped)
+
+    def run_program(self, program: str, sync: bool = True, **kwargs):
+        """
+        Run a motion_program text on this turret.  Motors are named pan
+        and tilt and angles are *turret* degrees:
+
+            turret.run_program('''
+                parallel
+                    goto pan 45
+                    goto tilt 10
+                end
+                dwell 0.5
+                goto pan 0
+            ''')
+
+        The compiled timeline is cached on disk (see motion_program), so
+        re-running a program from the same position skips planning.
+        """
+        from motion_program import run_program
+        return run_program(
+            program, {'pan': self.pan, 'tilt': self.tilt},
+            ratios={'pan': self.pan_gear_ratio, 'tilt': self.tilt_gear_ratio},
+            sync=sync, **kwargs)
+
+    @staticmethod
+    def _steps_toward(stepper: Stepper, from_pos: int, angle: float) -> int:
+        """Signed half-steps from position from_pos to angle, shortest way."""
+        delta = (angle - from_pos / stepper.steps_per_degree + 180.0) % 360.0 - 180.0
+        return round(delta * stepper.steps_per_degree)
+
+    # ---------- hardware setup / shutdown ----------
+
+    def open(self) -> "TurretMotors":
+        """
+        Set up the shift register pins now instead of on the first move.
+        Returns self; `with TurretMotors(...) as turret:` opens and
+        closes the turret.
+        """
+        self.shifter.open()
+        return self
+
+    def close(self) -> None:
+        """
+        Stop both motors (dropping queued moves), release the shift
+        register pins (unless the shifter was passed in) and, with a
+        state file, save the gear ratios and mark the saved position
+        clean.  The turret can still be used afterwards: the next move
+        sets the pins up again.
+        """
+        self.tilt.flush()
+        self.pan.close()
+        if self.state is not None and not self.state.closed:
+            self._save_gear_ratios()
+            # Move the positions back into private memory so the file
+            # can be unmapped.
+            for stepper in (self.pan, self.tilt):
+                stepper.use_state(multiprocessing.RawValue('l', stepper.position),
+                                  multiprocessing.RawValue('i', stepper.step_state))
+            self.state.close()
+        if self._owns_shifter:
+            self.shifter.close()
+
+    def __enter__(self) -> "TurretMotors":
+        return self.open()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def start_recording(self, path: str):
+        """
+        Record this session to a motion_trace file: every goto/track/...
+        as the stepper commands it turns into (slot 0 = pan, 1 = tilt on
+        the turret's own shifter) and every shift word, with timestamps.
+        Replay it with motion_trace.replay().
+        """
+        return self.pan.start_recording(path)
+
+    def stop_recording(self) -> None:
+        self.pan.stop_recording()
+
+    # ---------- asyncio API ----------
+    #
+    # Same moves as above, but awaitable: the event loop keeps running
+    # while the motors move.  Cancelling the awaiting task cancels the
+    # move(s) on the motors too.
+
+    async def goto_async(self, pan_deg: float, tilt_deg: float,
+                         coordinated: bool = False) -> None:
+        """Awaitable goto()."""
+        import asyncio
+        if coordinated:
+            while self.pan.busy() or self.tilt.busy():
+                await asyncio.sleep(0.002)
+            handles = self.run_plan(self.plan_goto(pan_deg, tilt_deg), sync=False)
+        else:
+            handles = self.goto(pan_deg, tilt_deg, sync=False)
+        await _wait_all(handles)
+
+    async def goto_pan_async(self, pan_deg: float) -> None:
+        """Awaitable goto_pan()."""
+        await self.goto_pan(pan_deg, sync=False)
+
+    async def goto_tilt_async(self, tilt_deg: float) -> None:
+        """Awaitable goto_tilt()."""
+        await self.goto_tilt(tilt_deg, sync=False)
+
+    async def positions(self, interval: float = 0.02):
+        """
+        Async stream of (pan_deg, tilt_deg) turret angles, yielding a new
+        pair whenever either axis has moved (checked every `interval`
+        seconds, reading the lock-free step counters):
+
+            async for pan, tilt in turret.positions():
+                await ws.send(f"{pan:.1f},{tilt:.1f}")
+        """
+        import asyncio
+        last = None
+        while True:
+            now = (self.pan.position, self.tilt.position)
+            if now != last:
+                last = now
+                yield self.pan_turret_angle, self.tilt_turret_angle
+            await asyncio.sleep(interval)
+
+
+async def _wait_all(handles) -> None:
+    import asyncio
+    try:
+        await asyncio.gather(*handles)
+    except asyncio.CancelledError:
+        for h in handles:
+            h.cancel()
+        raise
@@ -0,0 +1,129 @@
+# turret_planner.py
+#
+# Orders a batch of aim points so the turret spends as little time
+# slewing between them as possible.
+#
+# The cost of going from one target to another is the time the slower
+# axis needs (pan and tilt move at the same time), computed with the
+# same model the motors use: gear ratio, goAngle's shortest way round
+# on the stepper shaft, the drive mode and each motor's profile or step
+# delay.  The whole cost matrix is built in one NumPy pass, then a
+# nearest-neighbour tour from the current position is improved with
+# 2-opt.  For 20-100 targets that is within a few percent of optimal
+# and takes milliseconds.
+#
+# Example:
+#
+#     targets = [(30, 10), (-60, 5), (90, 20), ...]   # turret degrees
+#     plan = plan_sequence(turret, targets)
+#     print(plan.order, plan.total_time)
+#     for i in plan.order:
+#         turret.goto(*targets[i])
+
+from typing import NamedTuple
+import numpy as np
+from Lab8_4 import DRIVE_MODES
+from motion_profiles import move_times
+
+
+class SequencePlan(NamedTuple):
+    order: list          # indexes into the target list, in visiting order
+    total_time: float    # estimated slewing time for that order, s
+    given_time: float    # estimated slewing time in the order given, s
+
+
+def _axis_times(stepper, stepper_deg: np.ndarray) -> np.ndarray:
+    """Time (s) for `stepper` to turn by each delta (stepper degrees)."""
+    half_steps = np.floor(np.abs(stepper_deg) * stepper.steps_per_degree)
+    stride = DRIVE_MODES[stepper.drive_mode][0]
+    shifts = np.ceil(half_steps / stride)
+    if stepper.profile is not None:
+        return move_times(stepper.profile, shifts)
+    return shifts * stepper.delay / 1e6
+
+
+def _wrap(deg: np.ndarray) -> np.ndarray:
+    """Shortest signed rotation, like Stepper.goAngle: [-180, 180]."""
+    return (deg + 180.0) % 360.0 - 180.0
+
+
+def cost_matrix(turret, points: np.ndarray) -> np.ndarray:
+    """
+    points: (n, 2) array of (pan, tilt) turret degrees.
+    Returns C with C[i, j] = seconds to slew from point i to point j.
+    """
+    pan = points[:, 0] * turret.pan_gear_ratio
+    tilt = points[:, 1] * turret.tilt_gear_ratio
+    pan_t = _axis_times(turret.pan, _wrap(pan[None, :] - pan[:, None]))
+    tilt_t = _axis_times(turret.tilt, _wrap(tilt[None, :] - tilt[:, None]))
+    return np.maximum(pan_t, tilt_t)
+
+
+def _path_cost(cost: np.ndarray, path: np.ndarray) -> float:
+    return float(cost[path[:-1], path[1:]].sum())
+
+
+def _nearest_neighbour(cost: np.ndarray) -> np.ndarray:
+    n = len(cost)
+    path = [0]
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[0] = False
+    for _ in range(n - 1):
+        row = np.where(unvisited, cost[path[-1]], np.inf)
+        nxt = int(np.argmin(row))
+        path.append(nxt)
+        unvisited[nxt] = False
+    return np.array(path)
+
+
+def _two_opt(cost: np.ndarray, path: np.ndarray, max_passes: int = 50) -> np.ndarray:
+    """
+    Reverse path[i..k] whenever that shortens an open path whose first
+    node (the start position) stays fixed.  Every k for a given i is
+    scored at once with NumPy.
+    """
+    n = len(path)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = path[i - 1], path[i]
+            ks = np.arange(i + 1, n)
+            c = path[ks]
+            # the edge after c, if there is one (the path is open)
+            has_d = ks + 1 < n
+            d = path[np.minimum(ks + 1, n - 1)]
+            delta = cost[a, c] - cost[a, b]
+            delta = delta + np.where(has_d, cost[b, d] - cost[c, d], 0.0)
+            # (costs are symmetric, so edges inside the reversed
+            # segment cost the same backwards)
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                k = ks[best]
+                path[i:k + 1] = path[i:k + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return path
+
+
+def plan_sequence(turret, targets, start=None) -> SequencePlan:
+    """
+    Choose a visiting order for targets [(pan_deg, tilt_deg), ...] in
+    *turret* degrees, starting from `start` (default: where the turret
+    is now).  Returns a SequencePlan.
+    """
+    points = np.asarray(targets, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return SequencePlan([], 0.0, 0.0)
+    if start is None:
+        start = (turret.pan_turret_angle, turret.tilt_turret_angle)
+    nodes = np.vstack([np.asarray(start, dtype=float), points])
+    cost = cost_matrix(turret, nodes)
+
+    path = _two_opt(cost, _nearest_neighbour(cost))
+    given = np.arange(len(nodes))
+    return SequencePlan(
+        order=[int(p) - 1 for p in path[1:]],
+        total_time=_path_cost(cost, path),
+        given_time=_path_cost(cost, given),
+    )
@@ -0,0 +1,125 @@
+# turret_state.py
+#
+# Pan/tilt position kept in a small memory-mapped file, so a restarted
+# turret picks up where it was instead of assuming it is at zero.
+#
+# The file holds the two step counts, the coil phases and the gear
+# ratios.  The step counts and phases are not copies: TurretMotors
+# hands views into the mapping to its Steppers (Stepper.use_state), so
+# the scheduler worker's ordinary position updates *are* the file
+# writes, at no extra cost per step.  The kernel writes the page back
+# on its own; close() also flushes it.
+#
+# A dirty flag is set by the worker when a motor starts moving and
+# cleared when both are at rest again (and by close()), so a restart
+# can tell whether the last run stopped mid-move.  If it did (a crash
+# or power cut during a move), the position is the last step the
+# worker wrote, which the disk may not have caught up with before a
+# power cut: worth re-homing if accuracy matters.  A crash while the
+# turret stood still leaves the file clean.
+#
+# Example:
+#
+#     turret = TurretMotors(state_file="/var/lib/turret/state")
+#     if not turret.state.was_clean:
+#         print("last run stopped mid-move; check the zero")
+#     ...
+#     turret.close()      # marks the saved position clean
+
+import ctypes
+import mmap
+import os
+
+MAGIC = b'TRST'
+VERSION = 1
+
+
+class _Layout(ctypes.Structure):
+    # Positions use the native long, like Stepper's RawValue('l'), so a
+    # step is one aligned store; long_size guards against reading a file
+    # written by a build with a different long.
+    _fields_ = [
+        ('magic', ctypes.c_char * 4),
+        ('version', ctypes.c_uint16),
+        ('long_size', ctypes.c_uint16),
+        ('dirty', ctypes.c_uint32),
+        ('pan_position', ctypes.c_long),
+        ('tilt_position', ctypes.c_long),
+        ('pan_phase', ctypes.c_int),
+        ('tilt_phase', ctypes.c_int),
+        ('pan_gear_ratio', ctypes.c_double),
+        ('tilt_gear_ratio', ctypes.c_double),
+    ]
+
+
+SIZE = ctypes.sizeof(_Layout)
+
+
+class TurretState:
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the state file at path.
+
+        restored:   True if the file held saved state, which the fields
+                    below now contain; False if it was new or unreadable
+                    and has been reset (positions 0, gear ratios 1.0).
+        was_clean:  True if the saved state was not left mid-move.
+        """
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < SIZE:
+                os.ftruncate(fd, SIZE)
+            self._mm = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+
+        h = _Layout.from_buffer(self._mm)
+        self.restored = (h.magic == MAGIC and h.version == VERSION
+                         and h.long_size == ctypes.sizeof(ctypes.c_long))
+        self.was_clean = self.restored and not h.dirty
+        if not self.restored:
+            ctypes.memset(ctypes.addressof(h), 0, SIZE)
+            h.magic = MAGIC
+            h.version = VERSION
+            h.long_size = ctypes.sizeof(ctypes.c_long)
+            h.pan_gear_ratio = 1.0
+            h.tilt_gear_ratio = 1.0
+        self._mm.flush()
+        self._header = h
+
+        # Views into the mapping, each with a .value like a RawValue.
+        self.dirty = self._field('dirty')
+        self.pan_position = self._field('pan_position')
+        self.tilt_position = self._field('tilt_position')
+        self.pan_phase = self._field('pan_phase')
+        self.tilt_phase = self._field('tilt_phase')
+        self.pan_gear_ratio = self._field('pan_gear_ratio')
+        self.tilt_gear_ratio = self._field('tilt_gear_ratio')
+
+    def _field(self, name: str):
+        ctype = dict(_Layout._fields_)[name]
+        return ctype.from_buffer(self._mm, getattr(_Layout, name).offset)
+
+    @property
+    def closed(self) -> bool:
+        return self._mm is None
+
+    def flush(self) -> None:
+        """Write the mapping back to disk now."""
+        self._mm.flush()
+
+    def close(self) -> None:
+        """
+        Mark the state clean, flush it and unmap the file.  Anything
+        still using the views (Steppers) must let go of them first.
+        """
+        if self._mm is None:
+            return
+        self._header.dirty = 0
+        self._mm.flush()
+        del (self._header, self.dirty, self.pan_position, self.tilt_position, self.pan_phase,
+             self.tilt_phase, self.pan_gear_ratio, self.tilt_gear_ratio)
+        self._mm.close()
+        self._mm = None